@@ -1,106 +1,354 @@
+// CPython extension for finding prefixes and commands inside a message with a trie.
+// Build with:
+// gcc -Wall -shared -fPIC $(python3-config --includes) -o c_codes/parse_find$(python3-config --extension-suffix)
+//     c_codes/parse_find.c
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include "pythread.h"
 #include <string.h>
-#include <stdio.h>
 #include <stdlib.h>
 
-typedef struct ResultStruct{
-    char** found_array;
+// Inputs at least this long are walked with the GIL released
+#define RELEASE_GIL_SIZE 512
+// Matches that fit here don't need a heap allocation
+#define FOUND_INLINE_SIZE 16
+
+typedef struct TrieNodeStruct{
+    unsigned char* keys;
+    struct TrieNodeStruct** children;
     int size;
-}Result;
-
-char** append(char**, size_t*, const char*);
-int search(char**, char[], int);
-char* reverse(char*);
-Result* compile_result(char** array, int size);
-
-Result* find_commands(char** commands, char* string, int n){
-    // Returns 2D char array of commands that it found from given string
-    size_t found = 1;
-    char** found_cmd = calloc(sizeof(char*), found);
-    // Remember stella, this iterate each word it founds.
-    char* word = strtok(string, " ");
-    while(word != NULL) {
-        char* target = reverse(word);
-        int view = strlen(word);
-        while (view > 0){
-            char temporary = target[view];
-            target[view] = '\0';
-            int index = search(commands, target, n);
-            if (index != -1){
-                char* command = reverse(commands[index]);
-                found_cmd = append(found_cmd, &found, command);
-                free(command);
-            }
-            target[view] = temporary;
-            view--;
+    // Interned str of the word ending at this node, it is handed out as is instead of being copied
+    PyObject* word;
+}TrieNode;
+
+typedef struct FoundStruct{
+    TrieNode** nodes;
+    Py_ssize_t size;
+    Py_ssize_t capacity;
+    TrieNode* inline_nodes[FOUND_INLINE_SIZE];
+}Found;
+
+typedef struct {
+    PyObject_HEAD
+    TrieNode* root;
+    Py_ssize_t size;
+    int reverse;
+    PyThread_type_lock lock;
+}TrieObject;
+
+TrieNode* create_node(void);
+TrieNode* get_child(TrieNode*, unsigned char);
+TrieNode* add_child(TrieNode*, unsigned char);
+void free_node(TrieNode*);
+int found_append(Found*, TrieNode*);
+
+void trie_find_commands(TrieNode* root, const char* string, Py_ssize_t length, Found* found){
+    // Collects every command that each word ends with, the trie must be compiled in reverse
+    Py_ssize_t start = 0;
+    while(start < length) {
+        Py_ssize_t end = start;
+        while(end < length && string[end] != ' ')
+            end++;
+        // Walking the word backward gives every command that the word ends with
+        TrieNode* node = root;
+        for(Py_ssize_t view = end - 1; view >= start; view--){
+            if ((node = get_child(node, (unsigned char) string[view])) == NULL)
+                break;
+            if (node->word != NULL && found_append(found, node) < 0)
+                return;
         }
-        free(target);
-        word = strtok(NULL, " ");
+        start = end + 1;
+    }
+}
+
+void trie_find_prefix(TrieNode* root, const char* content, Py_ssize_t length, Found* found){
+    // Walks the content once through the trie, collecting every prefix that the content starts with
+    TrieNode* node = root;
+    for(Py_ssize_t i = 0; i < length; i++){
+        if ((node = get_child(node, (unsigned char) content[i])) == NULL)
+            break;
+        if (node->word != NULL && found_append(found, node) < 0)
+            return;
     }
-    return compile_result(found_cmd, found);
-}
-
-Result* compile_result(char** array, int size){
-    // Creates a struct pointer to return to Python
-    Result* pointer_result = malloc(sizeof(Result));
-    Result result = {array, size - 1};
-    *pointer_result = result;
-    return pointer_result;
-}
-
-Result* multi_find_prefix(char** prefixes, char content[], int n){
-    // Creates a 2D char array of prefixes it found from content
-    int start = strlen(content);
-    size_t found = 1;
-    char** found_prefixes = calloc(sizeof(char*), found);
-    while(start > 0){
-        int result = search(prefixes, content, n);
-        if (result != -1)
-            found_prefixes = append(found_prefixes, &found, content);
-        content[start-=1] = '\0';
+}
+
+int trie_insert(TrieNode* root, PyObject* str, const char* word, Py_ssize_t n, int reverse){
+    // Insert a single word into the trie, returns 1 when the word is new, 0 when it already exist and -1 on failure.
+    // The node keeps a reference to the interned str.
+    TrieNode* node = root;
+    for(Py_ssize_t i = 0; i < n; i++){
+        unsigned char key = word[reverse? (n - 1) - i: i];
+        TrieNode* child = get_child(node, key);
+        if ((node = child != NULL? child: add_child(node, key)) == NULL)
+            return -1;
+    }
+    if (node->word != NULL)
+        return 0;
+    Py_INCREF(str);
+    PyUnicode_InternInPlace(&str);
+    node->word = str;
+    return 1;
+}
+
+TrieNode* create_node(void){
+    // Allocates an empty trie node with no children
+    return calloc(1, sizeof(TrieNode));
+}
+
+TrieNode* get_child(TrieNode* node, unsigned char key){
+    // Linear search on the children, most nodes only have a handful of them
+    for(int i = 0; i < node->size; i++)
+        if (node->keys[i] == key)
+            return node->children[i];
+    return NULL;
+}
+
+TrieNode* add_child(TrieNode* node, unsigned char key){
+    // Append a new child node under the given key
+    int size = node->size + 1;
+    unsigned char* keys = realloc(node->keys, size * sizeof(unsigned char));
+    if (keys == NULL)
+        return NULL;
+    node->keys = keys;
+    TrieNode** children = realloc(node->children, size * sizeof(TrieNode*));
+    if (children == NULL)
+        return NULL;
+    node->children = children;
+    TrieNode* child = create_node();
+    if (child == NULL)
+        return NULL;
+    node->keys[node->size] = key;
+    node->children[node->size] = child;
+    node->size = size;
+    return child;
+}
+
+void free_node(TrieNode* node){
+    // Free the trie recursively, the root node is also freed
+    for(int i = 0; i < node->size; i++)
+        free_node(node->children[i]);
+    free(node->keys);
+    free(node->children);
+    Py_XDECREF(node->word);
+    free(node);
+}
+
+void found_init(Found* found){
+    // Starts with the inline storage, only a message with many matches moves to the heap
+    found->nodes = found->inline_nodes;
+    found->size = 0;
+    found->capacity = FOUND_INLINE_SIZE;
+}
+
+void found_free(Found* found){
+    if (found->nodes != found->inline_nodes)
+        free(found->nodes);
+}
+
+int found_append(Found* found, TrieNode* node){
+    // Append a matched node, the array grows by doubling
+    if (found->size == found->capacity) {
+        Py_ssize_t capacity = found->capacity * 2;
+        TrieNode** nodes;
+        if (found->nodes == found->inline_nodes) {
+            if ((nodes = malloc(capacity * sizeof(TrieNode*))) != NULL)
+                memcpy(nodes, found->inline_nodes, sizeof(found->inline_nodes));
+        } else {
+            nodes = realloc(found->nodes, capacity * sizeof(TrieNode*));
+        }
+        if (nodes == NULL)
+            return -1;
+        found->nodes = nodes;
+        found->capacity = capacity;
     }
-    return compile_result(found_prefixes, found);
-}
-
-char** append(char** arr, size_t* size, const char* target){
-    // Append new char array into a 2D char array
-    arr[*size - 1] = strdup(target);
-    return realloc(arr, (*size+=1) * sizeof(char*));
-}
-
-int search(char** arr, char target[], int n){
-    // Binary search for 2D array and return the index of target, -1 if it can't find it
-    int low = 0;
-    int high = n - 1;
-    while (high >= low) {
-        int mid = low + (high - low) / 2;
-        int result = strcmp(arr[mid], target);
-        if(result == 0)
-            return mid;
-        if(result > 0)
-            high = mid - 1;
-        else if(result < 0)
-            low = mid + 1;
+    found->nodes[found->size++] = node;
+    return 0;
+}
+
+static void acquire_lock(TrieObject* self){
+    // Avoids holding the GIL while another thread is walking this trie
+    if (!PyThread_acquire_lock(self->lock, NOWAIT_LOCK)) {
+        Py_BEGIN_ALLOW_THREADS
+        PyThread_acquire_lock(self->lock, WAIT_LOCK);
+        Py_END_ALLOW_THREADS
     }
+}
+
+static int get_buffer(PyObject* content, const char** string, Py_ssize_t* length){
+    // Reads the utf-8 of a str without copying, CPython keeps it on the str after the first request
+    if (PyUnicode_Check(content))
+        return (*string = PyUnicode_AsUTF8AndSize(content, length)) == NULL? -1: 0;
+    if (PyBytes_Check(content))
+        return PyBytes_AsStringAndSize(content, (char**) string, length);
+    PyErr_Format(PyExc_TypeError, "content must be str or bytes, not %.100s", Py_TYPE(content)->tp_name);
     return -1;
 }
 
-void free_result(Result* pointer_result){
-    // Free the allocated memory of Result pointer
-    int size = (*pointer_result).size;
-    // Due to strdup stored in the array, it is required to free from the heap for each element
-    for(int i = size - 1; i >= 0; i--)
-        free((*pointer_result).found_array[i]);
-    // Now we can release the array
-    free((*pointer_result).found_array);
-    free(pointer_result);
+static PyObject* trie_search(TrieObject* self, PyObject* content,
+                             void (*walk)(TrieNode*, const char*, Py_ssize_t, Found*)){
+    // Shared by find_prefix and find_commands, the walk only touches C memory so the GIL can be released
+    const char* string;
+    Py_ssize_t length;
+    if (get_buffer(content, &string, &length) < 0)
+        return NULL;
+
+    Found found;
+    found_init(&found);
+    if (length >= RELEASE_GIL_SIZE) {
+        Py_BEGIN_ALLOW_THREADS
+        PyThread_acquire_lock(self->lock, WAIT_LOCK);
+        walk(self->root, string, length, &found);
+        PyThread_release_lock(self->lock);
+        Py_END_ALLOW_THREADS
+    } else {
+        acquire_lock(self);
+        walk(self->root, string, length, &found);
+        PyThread_release_lock(self->lock);
+    }
+
+    // An empty tuple is a singleton, so the common case of nothing found allocates nothing
+    PyObject* result = PyTuple_New(found.size);
+    for(Py_ssize_t i = 0; result != NULL && i < found.size; i++){
+        Py_INCREF(found.nodes[i]->word);
+        PyTuple_SET_ITEM(result, i, found.nodes[i]->word);
+    }
+    found_free(&found);
+    return result;
+}
+
+static PyObject* Trie_find_prefix(TrieObject* self, PyObject* content){
+    return trie_search(self, content, trie_find_prefix);
+}
+
+static PyObject* Trie_find_commands(TrieObject* self, PyObject* content){
+    return trie_search(self, content, trie_find_commands);
+}
+
+static int insert_word(TrieObject* self, PyObject* word){
+    // Inserts a str into the trie, returns the same value as trie_insert
+    Py_ssize_t length;
+    const char* string = PyUnicode_AsUTF8AndSize(word, &length);
+    if (string == NULL)
+        return -1;
+
+    acquire_lock(self);
+    int added = trie_insert(self->root, word, string, length, self->reverse);
+    PyThread_release_lock(self->lock);
+    if (added < 0)
+        PyErr_NoMemory();
+    self->size += added > 0;
+    return added;
+}
+
+static PyObject* Trie_insert(TrieObject* self, PyObject* word){
+    int added = insert_word(self, word);
+    if (added < 0)
+        return NULL;
+    return PyBool_FromLong(added);
+}
+
+static PyObject* Trie_new(PyTypeObject* type, PyObject* args, PyObject* kwargs){
+    TrieObject* self = (TrieObject*) type->tp_alloc(type, 0);
+    if (self == NULL)
+        return NULL;
+    self->root = create_node();
+    self->lock = PyThread_allocate_lock();
+    if (self->root == NULL || self->lock == NULL) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+    return (PyObject*) self;
 }
 
-char* reverse(char* word){
-    // Reverse an array of character.
-    int n = strlen(word);
-    char* reverse_word = strdup(word);
-    for(int i = 0; i < n; i++){
-        reverse_word[i] = word[(n - 1) - i];
+static int Trie_init(TrieObject* self, PyObject* args, PyObject* kwargs){
+    static char* kwlist[] = {"", "reverse", NULL};
+    PyObject* words = NULL;
+    int reverse = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O$p:Trie", kwlist, &words, &reverse))
+        return -1;
+
+    self->reverse = reverse;
+    if (words == NULL)
+        return 0;
+
+    PyObject* iterator = PyObject_GetIter(words);
+    if (iterator == NULL)
+        return -1;
+    PyObject* word;
+    while((word = PyIter_Next(iterator)) != NULL) {
+        int added = insert_word(self, word);
+        Py_DECREF(word);
+        if (added < 0)
+            break;
     }
-    return reverse_word;
-}
\ No newline at end of file
+    Py_DECREF(iterator);
+    return PyErr_Occurred()? -1: 0;
+}
+
+static void Trie_dealloc(TrieObject* self){
+    if (self->root != NULL)
+        free_node(self->root);
+    if (self->lock != NULL)
+        PyThread_free_lock(self->lock);
+    Py_TYPE(self)->tp_free((PyObject*) self);
+}
+
+static Py_ssize_t Trie_len(TrieObject* self){
+    return self->size;
+}
+
+static PyMethodDef Trie_methods[] = {
+    {"insert", (PyCFunction) Trie_insert, METH_O,
+     "Inserts a single word without rebuilding, returns False when the word already exist."},
+    {"find_prefix", (PyCFunction) Trie_find_prefix, METH_O,
+     "Returns a tuple of every word in the trie that the content starts with."},
+    {"find_commands", (PyCFunction) Trie_find_commands, METH_O,
+     "Returns a tuple of every word in the reversed trie that any space separated word of the content ends with."},
+    {NULL}
+};
+
+static PySequenceMethods Trie_as_sequence = {
+    .sq_length = (lenfunc) Trie_len,
+};
+
+static PyTypeObject TrieType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "parse_find.Trie",
+    .tp_doc = "Trie(words=(), /, *, reverse=False)\n\nTrie that lives in C memory. A reversed trie stores each word "
+              "from the last character, which is used for finding commands.",
+    .tp_basicsize = sizeof(TrieObject),
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_new = Trie_new,
+    .tp_init = (initproc) Trie_init,
+    .tp_dealloc = (destructor) Trie_dealloc,
+    .tp_methods = Trie_methods,
+    .tp_as_sequence = &Trie_as_sequence,
+};
+
+static PyModuleDef parse_find_module = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "parse_find",
+    .m_doc = "Trie matching for prefixes and commands.",
+    .m_size = -1,
+};
+
+PyMODINIT_FUNC PyInit_parse_find(void){
+    if (PyType_Ready(&TrieType) < 0)
+        return NULL;
+
+    PyObject* module = PyModule_Create(&parse_find_module);
+    if (module == NULL)
+        return NULL;
+
+    Py_INCREF(&TrieType);
+    if (PyModule_AddObject(module, "Trie", (PyObject*) &TrieType) < 0) {
+        Py_DECREF(&TrieType);
+        Py_DECREF(module);
+        return NULL;
+    }
+    if (PyModule_AddIntConstant(module, "RELEASE_GIL_SIZE", RELEASE_GIL_SIZE) < 0) {
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}
@@ -9,7 +9,7 @@ from discord.ext import commands
 
 from utils.flags import ArgumentParsingError
 from utils.useful import StellaEmbed, print_exception, multiget
-from utils.errors import NotInDpy, BypassError
+from utils.errors import NotInDpy, BypassError, RenderBusy
 from utils.buttons import BaseButton, ViewIterationAuthor
 
 
@@ -76,7 +76,7 @@ class ErrorHandler(commands.Cog):
                 return
 
         ignored = (commands.CommandNotFound,)
-        default_error = (commands.NotOwner, commands.TooManyArguments, ArgumentParsingError, NotInDpy)
+        default_error = (commands.NotOwner, commands.TooManyArguments, ArgumentParsingError, NotInDpy, RenderBusy)
 
         error = getattr(error, 'original', error)
 
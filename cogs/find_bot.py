@@ -1,14 +1,13 @@
 from __future__ import annotations
 
 import base64
-import io
 
 import discord
 import datetime
 import re
 import asyncio
 import itertools
-import ctypes
+import math
 import contextlib
 import functools
 import collections
@@ -24,15 +23,17 @@ from discord.ext.menus import ListPageSource
 from aiogithub.objects import Repo
 from fuzzywuzzy import fuzz
 from utils import flags as flg
-from utils.image_manipulation import get_majority_color, islight, create_bar, process_image
-from utils.new_converters import BotPrefixes, IsBot, BotCommands
+from utils.image_manipulation import islight, create_bar, process_image
+from utils.new_converters import BotPrefixes, IsBot, BotCommands, prefix_arrays
 from utils.buttons import InteractionPages, PromptView
-from utils.useful import try_call, StellaEmbed, compile_array, search_prefixes, default_date, plural, realign, \
+from utils.useful import try_call, StellaEmbed, CompiledTrie, PrefixGate, search_prefixes, default_date, plural, realign, \
     search_commands, StellaContext, aware_utc, print_exception
 from utils.errors import NotInDatabase, BotNotFound
 from utils.decorators import is_discordpy, event_check, wait_ready, pages, listen_for_guilds
 from utils import greedy_parser
-from typing import Any, Optional, Union, List, Tuple, Callable, Dict, Coroutine, TYPE_CHECKING, AsyncGenerator, Type, TypeVar
+from utils.buffers import WriteBehindBuffer, AggregateBuffer
+from typing import Any, Optional, Union, List, Tuple, Callable, Dict, Coroutine, TYPE_CHECKING, AsyncGenerator, Type, TypeVar, \
+    Set, Awaitable
 
 if TYPE_CHECKING:
     from main import StellaBot
@@ -69,29 +70,25 @@ class BotPredictPrefixes:
     @classmethod
     async def convert(cls, ctx: StellaContext, argument: str) -> BotPredictPrefixes:
         user = await IsBot().convert(ctx, argument)
+        query = "SELECT prefix, letters, confidences FROM predicted_prefix WHERE bot_id=$1"
+        if predicted := await ctx.bot.pool_pg.fetchrow(query, user.id):
+            prefix, raw_data = predicted["prefix"], [*zip(predicted["letters"], predicted["confidences"])]
+            return cls.checked(user, prefix, raw_data)
+
         query = """
-            SELECT pt.letter, pt.position, pt.count, total, (pt.count::FLOAT) / (total::FLOAT) "percentage"
-            FROM position_letter pt
-            INNER JOIN (
-                SELECT position, MAX(count) as count FROM position_letter
-                WHERE bot_id=$1
-                GROUP BY position
-            ) AS m
-            ON (m.count=pt.count AND pt.position=m.position)
-            INNER JOIN (
-                SELECT position, SUM(count) "total"
-                FROM position_letter
-                WHERE bot_id=$1
-                GROUP BY position
-            ) AS sums
-            ON (sums.position=m.position)
+            SELECT letter, position, count, total, (count::FLOAT) / (total::FLOAT) "percentage"
+            FROM position_summary
             WHERE bot_id=$1
-            ORDER BY pt.position
+            ORDER BY position
         """
         if not (data := await ctx.bot.pool_pg.fetch(query, user.id)):
             raise NotInDatabase(user)
         NN = ctx.bot.derivative_prefix_neural
         prefix, raw_data = await NN.predict(data, return_raw=True)
+        return cls.checked(user, prefix, raw_data)
+
+    @classmethod
+    def checked(cls, user: discord.User, prefix: str, raw_data: List[Tuple[str, float]]) -> BotPredictPrefixes:
         instance = cls(user, prefix, raw_data)
         if not instance.prefix:
             raise commands.CommandError(
@@ -278,6 +275,141 @@ async def bot_pending_list(_, menu: Any, entry: Dict[str, Union[datetime.datetim
     return embed
 
 
+class BotResponseListener:
+    """Collects the bot responses of a single message during the listening window."""
+    __slots__ = ("message", "check", "future", "bots", "after_user", "flip")
+
+    def __init__(self, message: discord.Message, check: Callable[[discord.Message], bool], future: asyncio.Future):
+        self.message = message
+        self.check = check
+        self.future = future
+        self.bots = {}
+        self.after_user = {}
+        self.flip = False
+
+    def feed(self, responded: Union[discord.Message, ReactRespond]) -> None:
+        """Stores the bot responses, bots that responded after a user are only stored when replying to the message."""
+        if any(responded.author.id in respondance for respondance in (self.bots, self.after_user)):
+            return
+        self.flip |= not responded.author.bot
+        if not responded.author.bot:
+            return
+
+        if not self.flip:
+            self.bots.update({responded.author.id: responded})
+        elif getattr(responded.reference, "cached_message", None) == self.message:
+            self.after_user.update({responded.author.id: responded})
+
+    def resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result((self.bots, self.after_user))
+
+
+def search_text(*text_list: str) -> Callable[[discord.Message], bool]:
+    """Response check that looks for any of the text in the content or the embeds of a message."""
+    def actual_search(search_text: str) -> bool:
+        search_text = search_text.casefold()
+        return any(t in search_text for t in text_list)
+
+    def check(m: discord.Message) -> bool:
+        return actual_search(m.content) or any(actual_search(str(e.to_dict())) for e in m.embeds)
+    return check
+
+
+def check_jsk(m: discord.Message) -> bool:
+    possible_text = ("Jishaku", "discord.py", "Python ", "Module ", "guild(s)", "user(s).")
+    return all(text in m.content for text in possible_text)
+
+
+class DetectionRule:
+    """A probe that find_bot_prefixes runs on every message. A message that ends with the name after a short prefix
+       is treated as a command, the bots that respond and pass the check learn that prefix."""
+    __slots__ = ("name", "check", "pattern", "hits", "detected")
+
+    def __init__(self, name: str, check: Callable[[discord.Message], bool]):
+        self.name = name
+        self.check = check
+        self.pattern = re.compile("(?P<prefix>^.{{1,30}}?(?={}$))".format(re.escape(name)), re.I)
+        self.hits = 0
+        self.detected = 0
+
+    def match(self, content: str) -> Optional[str]:
+        """Returns the prefix when the content is a possible invocation of this rule."""
+        if (match := self.pattern.match(content)) and self.name not in match["prefix"]:
+            return match["prefix"]
+
+    def __repr__(self) -> str:
+        return f"<DetectionRule name={self.name!r} hits={self.hits} detected={self.detected}>"
+
+
+class ResponseCollector:
+    """Routes every message and reaction to the listeners of its channel, instead of each listener creating their
+       own wait_for. A message can have several listeners, one for each caller. Listeners are expired by a single timer
+       wheel that ticks every resolution seconds."""
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, window: float = 5, resolution: float = .25):
+        self.loop = loop
+        self.window = datetime.timedelta(seconds=window)
+        self.resolution = resolution
+        self.channels: Dict[int, Dict[int, List[BotResponseListener]]] = {}
+        self.wheel: List[List[BotResponseListener]] = [[] for _ in range(math.ceil(window / resolution) + 1)]
+        self.position = 0
+        self.ticking: Optional[asyncio.Task] = None
+
+    def listen(self, message: discord.Message, check: Callable[[discord.Message], bool]) -> asyncio.Future:
+        """Registers the message, the future returned resolves into the bots that responded once the window ends."""
+        listener = BotResponseListener(message, check, self.loop.create_future())
+        time_left = (message.created_at + self.window - discord.utils.utcnow()).total_seconds()
+        if time_left <= 0:
+            listener.resolve()
+            return listener.future
+
+        self.channels.setdefault(message.channel.id, {}).setdefault(message.id, []).append(listener)
+        ticks = min(math.ceil(time_left / self.resolution), len(self.wheel) - 1)
+        self.wheel[(self.position + ticks) % len(self.wheel)].append(listener)
+        if self.ticking is None or self.ticking.done():
+            self.ticking = self.loop.create_task(self.tick())
+        return listener.future
+
+    def feed_message(self, message: discord.Message) -> None:
+        for listener in [*itertools.chain.from_iterable(self.channels.get(message.channel.id, {}).values())]:
+            if message.id != listener.message.id and listener.check(message):
+                listener.feed(message)
+
+    def feed_reaction(self, reaction: discord.Reaction, user: Union[discord.Member, discord.User]) -> None:
+        message = reaction.message
+        for listener in self.channels.get(message.channel.id, {}).get(message.id, ()):
+            listener.feed(ReactRespond(datetime.datetime.utcnow(), user, None))
+
+    def expire(self, listener: BotResponseListener) -> None:
+        channel_id = listener.message.channel.id
+        message_id = listener.message.id
+        if (messages := self.channels.get(channel_id)) is not None and listener in messages.get(message_id, ()):
+            messages[message_id].remove(listener)
+            if not messages[message_id]:
+                messages.pop(message_id)
+            if not messages:
+                self.channels.pop(channel_id)
+        listener.resolve()
+
+    async def tick(self) -> None:
+        """Advances the timer wheel, it stops by itself when there is nothing left to expire."""
+        while self.channels:
+            await asyncio.sleep(self.resolution)
+            self.position = (self.position + 1) % len(self.wheel)
+            expired, self.wheel[self.position] = self.wheel[self.position], []
+            for listener in expired:
+                self.expire(listener)
+
+    def close(self) -> None:
+        """Resolves every listener right away, this is called when the cog unloads."""
+        if self.ticking is not None:
+            self.ticking.cancel()
+        for listener in itertools.chain.from_iterable(self.wheel):
+            self.expire(listener)
+        for slot in self.wheel:
+            slot.clear()
+
+
 deco_event = Callable[[Callable], Callable]
 
 
@@ -289,7 +421,18 @@ def is_user() -> deco_event:
 def prefix_cache_ready() -> deco_event:
     """Event check for command_count"""
     def predicate(self, message: discord.Message) -> bool:
-        return self.compiled_prefixes and self.compiled_commands and not message.author.bot
+        guild_id = message.guild.id
+        if message.author.bot or guild_id not in self.prefix_gate:
+            return False
+        return self.prefix_gate.might_match(guild_id, message.content) and self.compiled_prefixes.get(guild_id)
+    return event_check(predicate)
+
+
+def detection_candidate() -> deco_event:
+    """Event check for find_bot_prefixes, a detection only happens on a short message ending with a rule name."""
+    def predicate(self, message: discord.Message) -> bool:
+        content = message.content
+        return 1 < len(content) <= self.detection_max_size and content[-1].lower() in self.detection_last_chars
     return event_check(predicate)
 
 
@@ -307,34 +450,99 @@ class FindBot(commands.Cog, name="Bots"):
         re_bot = "[\s|\n]+(?P<id>[0-9]{17,19})[\s|\n]"
         re_reason = "+(?P<reason>.[\s\S\r]+)"
         self.re_addbot = re_command + re_bot + re_reason
+        self.addbot_first_chars = frozenset(prefix[0] for prefix in valid_prefix)
         self.re_github = re.compile(r'https?://(?:www\.)?github.com/(?P<repo_owner>(\w|-)+)/(?P<repo_name>(\w|-)+)?')
         self.cached_bots = {}
-        self.compiled_prefixes = None
-        self.compiled_commands = None
+        self.compiled_prefixes = {}
+        self.compiled_commands = CompiledTrie(reverse=True)
+        self.dirty_guilds = set()
+        self.prefix_gate = PrefixGate()
+        self.detection_rules: Dict[str, DetectionRule] = {}
+        self.detection_last_chars = set()
+        self.detection_max_size = 0
+        self.add_detection_rule("jsk", check_jsk)
+        self.add_detection_rule("help", search_text("command", "help", "category", "categories"))
+        self.add_detection_rule("ping", search_text("ping", "ms", "pong", "latency", "websocket", "bot", "database"))
+        self.response_collector = ResponseCollector(bot.loop)
+        self.commands_buffer = bot.add_write_buffer("commands_list", WriteBehindBuffer(self.flush_commands))
+        self.prefixes_buffer = bot.add_write_buffer("prefixes_list", AggregateBuffer(
+            self.flush_prefixes,
+            key=operator.itemgetter(0, 1, 2),
+            combine=lambda old, new: (*old[:3], old[3] + new[3], max(old[4], new[4]))
+        ))
+        self.position_buffer = bot.add_write_buffer("position_letter", AggregateBuffer(
+            self.flush_position_letters,
+            key=operator.itemgetter(0, 1, 2),
+            combine=lambda old, new: (*old[:3], old[3] + new[3]),
+            max_size=2000,
+            interval=30
+        ))
         self.all_bot_prefixes = {}
         self.all_bot_commands = {}
         bot.loop.create_task(self.loading_all_prefixes())
         bot.loop.create_task(self.task_handler())
+        self.prediction_task = bot.loop.create_task(self.prediction_handler())
 
     async def loading_all_prefixes(self) -> None:
-        """Loads all unique prefix when it loads and set compiled_pref for C code."""
+        """Loads all unique prefix when it loads and set compiled_prefixes trie of each guild for C code."""
         await self.bot.wait_until_ready()
-        prefix_data = await self.bot.pool_pg.fetch("SELECT DISTINCT bot_id, prefix FROM prefixes_list")
-        commands_data = await self.bot.pool_pg.fetch("SELECT DISTINCT bot_id, command FROM commands_list")
+        prefix_data = await self.bot.pool_pg.fetch("SELECT DISTINCT guild_id, bot_id, prefix FROM prefixes_list")
+        commands_data = await self.bot.pool_pg.fetch("SELECT DISTINCT guild_id, bot_id, command FROM commands_hourly")
         for prefix, command in itertools.zip_longest(prefix_data, commands_data):
             if prefix:
-                prefix_list = self.all_bot_prefixes.setdefault(prefix["bot_id"], set())
+                guild_bots = self.all_bot_prefixes.setdefault(prefix["guild_id"], {})
+                prefix_list = guild_bots.setdefault(prefix["bot_id"], set())
                 prefix_list.add(prefix["prefix"])
             if command:
-                command_list = self.all_bot_commands.setdefault(command["bot_id"], set())
+                guild_bots = self.all_bot_commands.setdefault(command["guild_id"], {})
+                command_list = guild_bots.setdefault(command["bot_id"], set())
                 command_list.add(command["command"])
         self.update_compile()
 
-    def update_compile(self) -> None:
-        temp = [*{prefix for prefix_list in self.all_bot_prefixes.values() for prefix in prefix_list}]
-        cmds = [*{command for command_list in self.all_bot_commands.values() for command in command_list}]
-        self.compiled_prefixes = compile_array(sorted(temp))
-        self.compiled_commands = compile_array(sorted(x[::-1] for x in cmds))
+    def update_compile(self, *guild_ids: int) -> None:
+        """Rebuilds the trie from scratch, every trie is rebuilt when no guild_ids is given.
+           This is only required when it first loads or when a prefix was removed."""
+        if not guild_ids:
+            guild_ids = [*self.all_bot_prefixes]
+            cmds = {command for guild_bots in self.all_bot_commands.values()
+                    for command_list in guild_bots.values() for command in command_list}
+            self.compiled_commands = CompiledTrie(cmds, reverse=True)
+
+        for guild_id in guild_ids:
+            guild_bots = self.all_bot_prefixes.get(guild_id, {})
+            temp = {prefix for prefix_list in guild_bots.values() for prefix in prefix_list}
+            self.compiled_prefixes[guild_id] = CompiledTrie(temp)
+            self.prefix_gate.reset(guild_id, temp)
+            self.dirty_guilds.discard(guild_id)
+
+    def add_bot_prefix(self, guild_id: int, bot_id: int, prefix: str) -> None:
+        """Adds a prefix into the guild cache and insert it into the guild trie when it was never seen."""
+        prefix_list = self.all_bot_prefixes.setdefault(guild_id, {}).setdefault(bot_id, set())
+        if prefix not in prefix_list:
+            prefix_list.add(prefix)
+            if (trie := self.compiled_prefixes.get(guild_id)) is None:
+                trie = self.compiled_prefixes[guild_id] = CompiledTrie()
+            trie.insert(prefix)
+            self.prefix_gate.add(guild_id, prefix)
+
+    def add_bot_command(self, guild_id: int, bot_id: int, command: str) -> None:
+        """Adds a command into the guild cache and insert it into the trie when it was never seen."""
+        command_list = self.all_bot_commands.setdefault(guild_id, {}).setdefault(bot_id, set())
+        if command not in command_list:
+            command_list.add(command)
+            self.compiled_commands.insert(command)
+
+    def remove_bot_prefix(self, guild_id: int, bot_id: int, prefix: str) -> None:
+        """Removes a prefix from the guild cache, the guild trie will be rebuilt on the next search."""
+        prefix_list = self.all_bot_prefixes.get(guild_id, {}).get(bot_id, set())
+        if prefix in prefix_list:
+            prefix_list.discard(prefix)
+            self.dirty_guilds.add(guild_id)
+
+    def bots_with_prefixes(self, guild: discord.Guild, prefixes: List[str]) -> Set[int]:
+        """Gets the bots that are still in the guild, which owns any of the given prefixes."""
+        return {bot_id for bot_id, prefix_list in self.all_bot_prefixes.get(guild.id, {}).items()
+                if not prefix_list.isdisjoint(prefixes) and guild.get_member(bot_id)}
 
     @commands.Cog.listener("on_member_join")
     @wait_ready()
@@ -350,46 +558,17 @@ class FindBot(commands.Cog, name="Bots"):
 
     async def listen_for_bots_at(self, message: discord.Message, message_check: Callable[[discord.Message], bool]) -> \
             Tuple[Dict[int, Union[discord.Message, ReactRespond]], Dict[int, Union[discord.Message, ReactRespond]]]:
-        """Listens for bots responding and terminating when a user respond"""
-        bots = {}
-        after_user = {}
-        time_to_listen = message.created_at + datetime.timedelta(seconds=5)
-        flip = 0
-
-        def reaction_add_check(reaction: discord.Reaction, _: discord.User) -> bool:
-            return reaction.message == message
-
-        stuff_here = locals()
-        with contextlib.suppress(asyncio.TimeoutError):
-            while time_to_listen > (time_rn := discord.utils.utcnow()):
-                time_left = (time_to_listen - time_rn).total_seconds()
-                done, didnt = await asyncio.wait(
-                    [self.bot.wait_for(event, check=stuff_here[f"{event}_check"], timeout=time_left) 
-                     for event in ("reaction_add", "message")],
-                    return_when=asyncio.FIRST_COMPLETED
-                )
-                for coro in done:
-                    coro.exception()
-
-                responded = done.pop().result()
-                if isinstance(responded, tuple):
-                    responded = ReactRespond(datetime.datetime.utcnow(), responded[1], None)
-
-                for coro in didnt:
-                    coro.cancel()
-
-                if any(responded.author.id in respondance for respondance in (bots, after_user)):
-                    continue
-                flip |= not responded.author.bot
-                if not responded.author.bot:
-                    continue
-
-                if not flip:
-                    bots.update({responded.author.id: responded})
-                elif getattr(responded.reference, "cached_message", None) == message:
-                    after_user.update({responded.author.id: responded})
-
-        return bots, after_user
+        """Listens for bots responding and terminating when a user respond. Only responses in the same channel
+           as the message are considered."""
+        return await self.response_collector.listen(message, message_check)
+
+    @commands.Cog.listener("on_message")
+    async def collect_bot_responses(self, message: discord.Message):
+        self.response_collector.feed_message(message)
+
+    @commands.Cog.listener("on_reaction_add")
+    async def collect_bot_reactions(self, reaction: discord.Reaction, user: Union[discord.Member, discord.User]):
+        self.response_collector.feed_reaction(reaction, user)
 
     @commands.Cog.listener("on_member_remove")
     @wait_ready()
@@ -401,8 +580,9 @@ class FindBot(commands.Cog, name="Bots"):
             self.bot.confirmed_bots.remove(member.id)
 
     async def update_prefix_bot(self, message: discord.Message, func: Callable[[discord.Message], bool],
-                                prefix: str, command: str) -> None:
-        """Updates the prefix of a bot, or multiple bot where it waits for the bot to respond. It updates in the database."""
+                                prefix: str, command: str) -> int:
+        """Updates the prefix of a bot, or multiple bot where it waits for the bot to respond. It updates in the database.
+           Returns the amount of bot that learned the prefix."""
         def setting(inner):
             def check(msg):
                 return msg.channel == message.channel and not msg.author.bot or inner(msg)
@@ -410,78 +590,71 @@ class FindBot(commands.Cog, name="Bots"):
 
         message_sent, after = await self.listen_for_bots_at(message, setting(func))
         if not message_sent and not after:
-            return
+            return 0
 
         message_sent.update(after)
-        bots_responded = list(message_sent)
         # Possibility of duplication removal
-        exist_query = "SELECT * FROM prefixes_list WHERE guild_id=$1 AND bot_id=ANY($2::BIGINT[])"
-        existing = await self.bot.pool_pg.fetch(exist_query, message.guild.id, bots_responded)
-        for x in existing:
-            if prefix.startswith(x["prefix"]) and x["bot_id"] in bots_responded:
-                message_sent.pop(x["bot_id"], None)
+        guild_bots = self.all_bot_prefixes.get(message.guild.id, {})
+        for bot_id in list(message_sent):
+            if any(prefix.startswith(x) for x in guild_bots.get(bot_id, ())):
+                message_sent.pop(bot_id)
 
         if not message_sent:
-            return
+            return 0
 
         prefix_list = [(message.guild.id, x, prefix, 1, m.created_at.replace(tzinfo=None)) for x, m in message_sent.items()]
         command_list = [(message.guild.id, x, command, m.created_at.replace(tzinfo=None)) for x, m in message_sent.items()]
 
-        await self.insert_both_prefix_command(prefix_list, command_list)
-
-        for _, x, prefix, _, _ in prefix_list:
-            prefix_list = self.all_bot_prefixes.setdefault(x, set())
-            prefix_list.add(prefix)
-
-        for _, bot, command, _ in command_list:
-            command_list = self.all_bot_commands.setdefault(bot, set())
-            command_list.add(command)
-
-        self.update_compile()
+        self.insert_both_prefix_command(prefix_list, command_list)
+        return len(message_sent)
 
     @commands.Cog.listener("on_message")
     @wait_ready()
     @listen_for_guilds()
     @is_user()
+    @detection_candidate()
     async def find_bot_prefixes(self, message: discord.Message):
         """This function is responsible for point of entry of the bot detection. All bot must went into here
            in order to be detected."""
-        def check_jsk(m):
-            possible_text = ("Jishaku", "discord.py", "Python ", "Module ", "guild(s)", "user(s).")
-            return all(text in m.content for text in possible_text)
-
-        def search(*text_list):
-            def actual_search(search_text):
-                return any(f"{t}" in search_text.casefold() for t in text_list)
-            return actual_search
-
-        def check_help(m):
-            target = search("command", "help", "category", "categories")
-            content = target(m.content)
-            embeds = any(target(str(e.to_dict())) for e in m.embeds)
-            return content or embeds
-
-        def check_ping(m):
-            target = search("ping", "ms", "pong", "latency", "websocket", "bot", "database")
-            content = target(m.content)
-            embeds = any(target(str(e.to_dict())) for e in m.embeds)
-            return content or embeds
-
-        for func in filter(lambda x: getattr(x, "__name__", "").startswith("check"), locals().values()):
-            name = func.__name__.replace("check_", "")
-            if match := re.match("(?P<prefix>^.{{1,30}}?(?={}$))".format(name), message.content, re.I):
-                if name not in match["prefix"]:
-                    return await self.update_prefix_bot(message, func, match["prefix"], name)
+        for rule in self.detection_rules.values():
+            if prefix := rule.match(message.content):
+                rule.hits += 1
+                rule.detected += await self.update_prefix_bot(message, rule.check, prefix, rule.name)
+                return
+
+    def add_detection_rule(self, name: str, check: Callable[[discord.Message], bool]) -> DetectionRule:
+        """Registers a probe for find_bot_prefixes, a rule with the same name is replaced."""
+        rule = self.detection_rules[name] = DetectionRule(name, check)
+        self.update_detection_gate()
+        return rule
+
+    def remove_detection_rule(self, name: str) -> Optional[DetectionRule]:
+        rule = self.detection_rules.pop(name, None)
+        self.update_detection_gate()
+        return rule
+
+    def update_detection_gate(self) -> None:
+        names = [*self.detection_rules]
+        self.detection_last_chars = {name[-1].lower() for name in names}
+        self.detection_max_size = 30 + max(map(len, names), default=0)
 
     async def search_respond(
             self,
-            callback: Callable[[Tuple[ctypes.c_char_p, int], ctypes.c_char_p], Coroutine[Any, Any, List[str]]],
+            callback: Callable[[CompiledTrie, str], Coroutine[Any, Any, Optional[Tuple[str, ...]]]],
             message: discord.Message, word: str, _type: str
-    ) -> Optional[Tuple[filter, List[str], Dict[int, discord.Message]]]:
+    ) -> Optional[Tuple[List[Dict[str, Union[int, str]]], Tuple[str, ...], Dict[int, discord.Message]]]:
         """Gets the prefix/command that are in this message, gets the bot that responded
            and return them."""
-        content_compiled = ctypes.create_string_buffer(word.encode("utf-8"))
-        if not (result := await callback(getattr(self, f"compiled_{_type}"), content_compiled)):
+        guild = message.guild
+        if guild.id in self.dirty_guilds:
+            self.update_compile(guild.id)
+
+        compiled = self.compiled_prefixes.get(guild.id) if _type == "prefixes" else self.compiled_commands
+        if not (result := await callback(compiled, word)):
+            return
+
+        # Prefixes from bots that left the guild will never respond, not worth listening for
+        if _type == "prefixes" and not self.bots_with_prefixes(guild, result):
             return
 
         singular = _type[:len(_type) - ((_type != "commands") + 1)]
@@ -494,21 +667,48 @@ class FindBot(commands.Cog, name="Bots"):
             return
 
         bot_found.update(after)
-        bot_found_keys = list(bot_found)
-        query = f"SELECT DISTINCT bot_id, {singular} FROM {_type}_list " \
-                f"WHERE guild_id=$1 AND bot_id=ANY($2::BIGINT[]) AND {singular}=ANY($3::VARCHAR[])"
-        bots = await self.bot.pool_pg.fetch(query, message.guild.id, bot_found_keys, result)
-        responded = filter(lambda x: x["bot_id"] in bot_found, bots)
+        guild_bots = getattr(self, f"all_bot_{_type}").get(guild.id, {})
+        responded = [{"bot_id": bot_id, singular: value}
+                     for bot_id in bot_found for value in result if value in guild_bots.get(bot_id, ())]
         return responded, result, bot_found
 
-    async def insert_both_prefix_command(self, prefix_list: List[Union[int, str]], command_list: List[Union[int, str]]) -> None:
-        command_list_query = "INSERT INTO commands_list VALUES($1, $2, $3, $4)"
-        prefix_list_query = "INSERT INTO prefixes_list VALUES($1, $2, $3, $4, $5) " \
-                            "ON CONFLICT (guild_id, bot_id, prefix) DO " \
-                            "UPDATE SET usage=prefixes_list.usage + 1, last_usage=$5"
-        
-        for key in "command_list", "prefix_list":
-            await self.bot.pool_pg.executemany(locals()[f"{key}_query"], locals()[key])
+    def insert_both_prefix_command(self, prefix_list: List[Union[int, str]], command_list: List[Union[int, str]]) -> None:
+        """Queues the rows into the write behind buffers, while the cache is updated right away. Rows that can't fit
+           their column are skipped, they would only fail the whole batch on flush."""
+        prefix_list = [row for row in prefix_list if len(row[2]) <= self.MAX_NAME_LENGTH]
+        command_list = [row for row in command_list if len(row[2]) <= self.MAX_NAME_LENGTH]
+        self.commands_buffer.extend(command_list)
+        self.prefixes_buffer.extend(prefix_list)
+
+        for guild_id, bot_id, prefix, _, _ in prefix_list:
+            self.add_bot_prefix(guild_id, bot_id, prefix)
+
+        for guild_id, bot_id, command, _ in command_list:
+            self.add_bot_command(guild_id, bot_id, command)
+
+    async def flush_commands(self, rows: List[Tuple[int, int, str, datetime.datetime]]) -> None:
+        """Writes the raw rows with COPY, and adds them into the hourly rollup in the same transaction."""
+        columns = ("guild_id", "bot_id", "command", "time_used")
+        hourly = collections.Counter((*row[:3], row[3].replace(minute=0, second=0, microsecond=0)) for row in rows)
+        query = "INSERT INTO commands_hourly " \
+                "SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::VARCHAR[], $4::TIMESTAMP[], $5::INTEGER[]) " \
+                "ON CONFLICT (guild_id, bot_id, command, hour_used) DO " \
+                "UPDATE SET usage=commands_hourly.usage + EXCLUDED.usage"
+        async with self.bot.pool_pg.acquire() as conn:
+            async with conn.transaction():
+                await conn.copy_records_to_table("commands_list", records=rows, columns=columns)
+                await conn.execute(query, *map(list, zip(*((*key, usage) for key, usage in hourly.items()))))
+
+    async def flush_prefixes(self, rows: List[Tuple[int, int, str, int, datetime.datetime]]) -> None:
+        """Upserts every aggregated prefix usage in a single statement."""
+        query = "INSERT INTO prefixes_list " \
+                "SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::VARCHAR[], $4::INTEGER[], $5::TIMESTAMP[]) " \
+                "ON CONFLICT (guild_id, bot_id, prefix) DO " \
+                "UPDATE SET usage=prefixes_list.usage + EXCLUDED.usage, " \
+                "last_usage=GREATEST(prefixes_list.last_usage, EXCLUDED.last_usage)"
+        await self.bot.pool_pg.execute(query, *map(list, zip(*rows)))
+        for guild_id, bot_id in {row[:2] for row in rows}:
+            self.bot.prefix_scores.invalidate(guild_id, bot_id)
 
     # @commands.Cog.listener("on_message")
     # @wait_ready()
@@ -526,28 +726,22 @@ class FindBot(commands.Cog, name="Bots"):
         responded, result, message_sent = received
         prefixes_values = []
         commands_values = []
-        exist_query = "SELECT * FROM prefixes_list WHERE guild_id=$1 AND bot_id=$2"
+        guild_bots = self.all_bot_prefixes.get(message.guild.id, {})
         for command, bot in itertools.product(result, responded):
             if bot["command"] == command:
                 bot_id = bot['bot_id']
                 message_respond = message_sent[bot_id].created_at.replace(tzinfo=None)
                 target = re.escape(command)
                 if (match := re.match("(?P<prefix>^.{{1,100}}?(?={}))".format(target), word, re.I)) and len(match["prefix"]) < 31:
-                    existing = await self.bot.pool_pg.fetch(exist_query, message.guild.id, bot_id)
                     prefix = match["prefix"]
-                    if any(x['prefix'] != prefix and prefix.startswith(x["prefix"]) for x in existing):
+                    if any(x != prefix and prefix.startswith(x) for x in guild_bots.get(bot_id, ())):
                         continue
                     prefixes_values.append((message.guild.id, bot_id, prefix, 1, message_respond))
 
                 if message.content.casefold().startswith(command):
                     commands_values.append((message.guild.id, bot_id, command, message_respond))
 
-        for _, bot, prefix, _, _ in prefixes_values:
-            prefixes = self.all_bot_prefixes.setdefault(bot, set())
-            prefixes.add(prefix)
-        self.update_compile()
-
-        await self.insert_both_prefix_command(prefixes_values, commands_values)
+        self.insert_both_prefix_command(prefixes_values, commands_values)
 
     @commands.Cog.listener("on_message")
     @wait_ready()
@@ -575,12 +769,7 @@ class FindBot(commands.Cog, name="Bots"):
                 if got_command:
                     commands_values.append((message.guild.id, bot_id, got_command, message_respond))
 
-        for _, bot, command, _ in commands_values:
-            command_list = self.all_bot_commands.setdefault(bot, set())
-            command_list.add(command)
-        self.update_compile()
-
-        await self.insert_both_prefix_command(prefixes_values, commands_values)
+        self.insert_both_prefix_command(prefixes_values, commands_values)
 
     @commands.Cog.listener("on_message")
     @wait_ready()
@@ -618,6 +807,8 @@ class FindBot(commands.Cog, name="Bots"):
         """Tracks ?addbot command. This is an exact copy of R. Danny code."""
         if message.channel.id not in (559455534965850142, 381963689470984203, 381963705686032394):
             return
+        if message.content[:1] not in self.addbot_first_chars:
+            return
         if result := await self.is_valid_addbot(message, check=True):
             confirm = False
 
@@ -815,19 +1006,7 @@ class FindBot(commands.Cog, name="Bots"):
 
     async def get_all_prefix(self, ctx: StellaContext, prefix: str) -> List[discord.Member]:
         """Quick function that gets the amount of bots that has the same prefix in a server."""
-        sql = "SELECT * FROM prefixes_list WHERE guild_id=$1 AND prefix=$2"
-        data = await self.bot.pool_pg.fetch(sql, ctx.guild.id, prefix)
-
-        def mem(x):
-            return ctx.guild.get_member(x)
-
-        bot_list = []
-        for each in [mem(x['bot_id']) for x in data if mem(x['bot_id'])]:
-            bot = await BotPrefixes.convert(ctx, f"{each.id}")
-            if prefix in bot.all_raw_prefixes:
-                bot_list.append(bot)
-
-        return bot_list
+        return [bot for bot in await BotPrefixes.from_guild(ctx) if prefix in bot.all_raw_prefixes]
 
     @commands.command(aliases=["prefixbots", "pbots"],
                       brief="Shows the name of bot(s) have a given prefix.",
@@ -840,11 +1019,10 @@ class FindBot(commands.Cog, name="Bots"):
         desk = f"Bot(s) with `{prefix}` as prefix\n{list_bot}"
         await ctx.embed(description=plural(desk, len(list_bot)))
 
-    # @commands.command(aliases=["ap", "aprefix", "allprefixes"],
-    #                   brief="Shows every bot's prefix in the server.",
-    #                   help="Shows a list of every single bot's prefix in a server.",
-    #                   cls=flg.SFlagCommand) Disabled for now until i have time
-    # Disabled until i optimize this, which is never
+    @commands.command(aliases=["ap", "aprefix", "allprefixes"],
+                      brief="Shows every bot's prefix in the server.",
+                      help="Shows a list of every single bot's prefix in a server.",
+                      cls=flg.SFlagCommand)
     @commands.guild_only()
     @flg.add_flag("--count", type=bool, default=False, action="store_true",
                   help="Create a rank of the highest prefix that is being use by bots. This flag accepts True or False, "
@@ -852,20 +1030,11 @@ class FindBot(commands.Cog, name="Bots"):
     @flg.add_flag("--reverse", type=bool, default=False, action="store_true",
                   help="Reverses the list. This flag accepts True or False, default to False if not stated.")
     async def allprefix(self, ctx: StellaContext, **flags: bool):
-        if not (bots := await self.bot.pool_pg.fetch("SELECT * FROM prefixes_list WHERE guild_id=$1", ctx.guild.id)):
+        if not (data := await BotPrefixes.from_guild(ctx)):
             return await ctx.embed(description="Looks like I don't have any data in this server on bot prefixes.")
 
         attr = "count" if (count_mode := flags.pop("count", False)) else "prefix"
         reverse = flags.pop("reverse", False)
-        bot_getter = operator.itemgetter("bot_id")
-
-        def mem(x):
-            return ctx.guild.get_member(x)
-
-        data = []
-        for bot in filter(lambda b: mem(bot_getter(b)), bots):
-            bot_id = bot_getter(bot)
-            data.append(await BotPrefixes.convert(ctx, str(bot_id)))
 
         if count_mode:
             PrefixCount = collections.namedtuple("PrefixCount", "prefix count")
@@ -905,8 +1074,8 @@ class FindBot(commands.Cog, name="Bots"):
         await ctx.embed(**kwargs)
 
     async def create_bar(self, ctx: StellaContext, bot: Union[discord.Member, discord.User]) -> Optional[discord.File]:
-        query = 'SELECT command, COUNT(command) "usage" ' \
-                'FROM commands_list ' \
+        query = 'SELECT command, SUM(usage) "usage" ' \
+                'FROM commands_hourly ' \
                 'WHERE bot_id=$1 AND guild_id=$2 ' \
                 'GROUP BY command ' \
                 'ORDER BY usage DESC ' \
@@ -924,13 +1093,16 @@ class FindBot(commands.Cog, name="Bots"):
                        ylabel="Commands")
 
         asset = bot.display_avatar
-        avatar_bytes = io.BytesIO(await asset.read())
-        color = major = await get_majority_color(avatar_bytes)
-        if not islight(*major.to_rgb()) or bot == ctx.me:
-            color = discord.Color(ctx.bot.color)
-
-        bar = await create_bar(names, usages, str(color), **payload)
-        to_send = await process_image(avatar_bytes, bar)
+        chart_cache = self.bot.chart_cache
+        key = chart_cache.make_key("bar", names, usages, asset.key, bot == ctx.me, payload)
+        if (to_send := await chart_cache.get(key)) is None:
+            avatar_bytes = await self.bot.avatar_cache.read(asset)
+            color = major = await self.bot.avatar_cache.get_color(asset)
+            if not islight(*major.to_rgb()) or bot == ctx.me:
+                color = discord.Color(ctx.bot.color)
+
+            bar = await create_bar(names, usages, str(color), **payload)
+            to_send = await chart_cache.put(key, await process_image(avatar_bytes, bar))
         return discord.File(to_send, filename="picture.png")
 
     async def format_bot_info(self, ctx, bot: Union[discord.Member, discord.User]) -> discord.Embed:
@@ -1009,7 +1181,7 @@ class FindBot(commands.Cog, name="Bots"):
     async def botrank(self, ctx: StellaContext, bot: greedy_parser.UntilFlag[BotCommands] = None, **flags: bool):
         reverse = flags.pop("reverse", False)
         bots = {x.id: x for x in ctx.guild.members if x.bot}
-        query = "SELECT bot_id, COUNT(command) AS total_usage FROM commands_list " \
+        query = "SELECT bot_id, SUM(usage) AS total_usage FROM commands_hourly " \
                 "WHERE guild_id=$1 AND bot_id=ANY($2::BIGINT[]) " \
                 "GROUP BY bot_id"
         record = await self.bot.pool_pg.fetch(query, ctx.guild.id, list(bots))
@@ -1135,18 +1307,30 @@ class FindBot(commands.Cog, name="Bots"):
     async def delprefix(self, ctx: StellaContext, bot: BotOwner, *prefixes: str):
         query = "DELETE FROM prefixes_list WHERE guild_id=$1 AND bot_id=$2 AND prefix=$3"
         unique_prefixes = set(prefixes)
+        # Buffered rows of these prefixes would be upserted back after the delete
+        await self.prefixes_buffer.flush()
         await self.bot.pool_pg.executemany(query, [(ctx.guild.id, bot.bot.id, x) for x in unique_prefixes])
+        for prefix in unique_prefixes:
+            self.remove_bot_prefix(ctx.guild.id, bot.bot.id, prefix)
+        self.bot.prefix_scores.invalidate(ctx.guild.id, bot.bot.id)
         await ctx.confirmed()
 
     @_bot.command(help="Add prefixes into a specific bot for bot owners")
     async def addprefix(self, ctx: StellaContext, bot: BotOwner, *prefixes: str):
-        query = "INSERT INTO prefixes_list VALUES ($1, $2, $3, $4, $5)"
+        query = "INSERT INTO prefixes_list VALUES ($1, $2, $3, $4, $5) " \
+                "ON CONFLICT (guild_id, bot_id, prefix) DO " \
+                "UPDATE SET usage=GREATEST(prefixes_list.usage, EXCLUDED.usage), " \
+                "last_usage=GREATEST(prefixes_list.last_usage, EXCLUDED.last_usage)"
         unique_prefixes = set(prefixes)
         guild_id, bot_id = ctx.guild.id, bot.bot.id
+        await self.prefixes_buffer.flush()
         current_prefixes = await self.bot.pool_pg.fetch("SELECT * FROM prefixes_list WHERE guild_id=$1 AND bot_id=$2", guild_id, bot_id)
         max_usage = max([p['usage'] for p in current_prefixes] or [1])
         values = [(guild_id, bot_id, x, max_usage, datetime.datetime.utcnow()) for x in unique_prefixes]
         await self.bot.pool_pg.executemany(query, values)
+        for prefix in unique_prefixes:
+            self.add_bot_prefix(guild_id, bot_id, prefix)
+        self.bot.prefix_scores.invalidate(guild_id, bot_id)
         await ctx.maybe_reply(f"Successfully inserted `{'` `'.join(unique_prefixes)}`")
         await ctx.confirmed()
 
@@ -1172,7 +1356,7 @@ class FindBot(commands.Cog, name="Bots"):
         reverse = flags.get("reverse", False)
         query = "SELECT * FROM " \
                 "   (SELECT command, COUNT(command) AS command_count FROM " \
-                "       (SELECT DISTINCT bot_id, command FROM commands_list " \
+                "       (SELECT DISTINCT bot_id, command FROM commands_hourly " \
                 "       WHERE guild_id=$1 " \
                 "       GROUP BY bot_id, command) AS _ " \
                 "   GROUP BY command) AS _ " \
@@ -1280,12 +1464,40 @@ class FindBot(commands.Cog, name="Bots"):
             return
 
         bot_id = message.author.id
-        values = [(bot_id, x.lower(), i, 1) for i, x in enumerate(processed)]
-        sql = "INSERT INTO position_letter VALUES($1, $2, $3, $4) " \
+        # A few characters lower into two, which would not fit position_letter.letter and fail the flush
+        self.position_buffer.extend([(bot_id, letter, i, 1) for i, x in enumerate(processed)
+                                     if len(letter := x.lower()) == 1])
+
+    async def flush_position_letters(self, rows: List[Tuple[int, str, int, int]]) -> None:
+        """Upserts the coalesced letter count increments, then folds them into position_summary in the same
+           transaction. Counts only ever increase, so the most used letter of a position can only be replaced by a
+           letter that was just incremented."""
+        sql = "INSERT INTO position_letter " \
+              "SELECT * FROM unnest($1::BIGINT[], $2::CHAR[], $3::INT[], $4::INT[]) " \
               "ON CONFLICT(bot_id, letter, position) DO " \
-              "UPDATE SET count = position_letter.count + 1"
-
-        await self.bot.pool_pg.executemany(sql, values)
+              "UPDATE SET count = position_letter.count + EXCLUDED.count " \
+              "RETURNING bot_id, position, letter, count"
+        summary_sql = "INSERT INTO position_summary AS s " \
+                      "SELECT * FROM unnest($1::BIGINT[], $2::INT[], $3::CHAR[], $4::INT[], $5::INT[]) " \
+                      "ON CONFLICT(bot_id, position) DO " \
+                      "UPDATE SET letter = CASE WHEN EXCLUDED.count > s.count THEN EXCLUDED.letter ELSE s.letter END, " \
+                      "count = GREATEST(s.count, EXCLUDED.count), total = s.total + EXCLUDED.total"
+
+        added = collections.Counter()
+        for bot_id, _, position, count in rows:
+            added[bot_id, position] += count
+
+        async with self.bot.pool_pg.acquire() as conn:
+            async with conn.transaction():
+                updated = await conn.fetch(sql, *map(list, zip(*rows)))
+                top = {}
+                for record in updated:
+                    key = record["bot_id"], record["position"]
+                    if key not in top or record["count"] > top[key][1]:
+                        top[key] = record["letter"], record["count"]
+
+                summary = [(*key, letter, count, added[key]) for key, (letter, count) in top.items()]
+                await conn.execute(summary_sql, *map(list, zip(*summary)))
 
     @commands.command(aliases=["bpd"], help="Uses neural network to predict a bot's prefix.")
     async def botpredict(self, ctx: StellaContext, *, bot: BotPredictPrefixes):
@@ -1298,6 +1510,25 @@ class FindBot(commands.Cog, name="Bots"):
                f'**Overall Confidence: ** `{summation / len(bot.prefix) * 100:.2f}%`'
         await ctx.embed(title=f"Predicted Prefix for '{bot.bot}'", description=desc)
 
+    @commands.command(aliases=["pda"], help="Shows the predicted prefix of every bot in this server.")
+    @commands.guild_only()
+    async def predictall(self, ctx: StellaContext):
+        bots = {m.id: m for m in ctx.guild.members if m.bot}
+        query = "SELECT bot_id, prefix FROM predicted_prefix " \
+                "WHERE bot_id=ANY($1::BIGINT[]) AND prefix != '' " \
+                "ORDER BY bot_id"
+        if not (data := await self.bot.pool_pg.fetch(query, [*bots])):
+            raise commands.CommandError("None of the bots in this server has a predicted prefix yet.")
+
+        @pages(per_page=10)
+        async def predicted_page(instance, menu_inter: InteractionPages, entries: List[Dict[str, Union[int, str]]]):
+            number = menu_inter.current_page * instance.per_page + 1
+            contents = [f"{i}. {bots[e['bot_id']]} `{discord.utils.escape_markdown(e['prefix'])}`"
+                        for i, e in enumerate(entries, start=number)]
+            return StellaEmbed.default(ctx, title="Predicted Prefixes", description="\n".join(contents))
+
+        await InteractionPages(predicted_page(data)).start(ctx)
+
     @commands.command(aliases=["ab"], help="Shows the list of all bots in discord.py server and information.")
     @is_discordpy()
     async def allbots(self, ctx: StellaContext):
@@ -1394,9 +1625,9 @@ class FindBot(commands.Cog, name="Bots"):
         if not data:
             raise commands.CommandError("Looks like i have no data to analyse sry.")
 
-        dataset = [[d['prefix'], d['usage'], d['last_usage'].timestamp()] for d in data]
-        array = await self.bot.get_prefixes_dataset(dataset)
-        pairs = [(p, float(c)) for p, _, _, c in array]
+        prefixes, usage, last_usage = prefix_arrays(data)
+        scores = await self.bot.score_prefixes(usage, last_usage)
+        pairs = [*zip(prefixes.tolist(), scores.tolist())]
         pairs.sort(key=lambda x: x[1], reverse=True)
         size = min(len(pairs), 5)
         prefixes = "\n".join([f'`{self.clean_prefix(ctx, p)}`: **{c:.2f}%**' for p, c in itertools.islice(pairs, size)])
@@ -1408,8 +1639,8 @@ class FindBot(commands.Cog, name="Bots"):
     @commands.command(aliases=['findcommands', 'fc', 'fuck'], help="Finds all bots that has a particular command")
     @commands.guild_only()
     async def findcommand(self, ctx: StellaContext, *, command: str):
-        sql = 'SELECT bot_id, COUNT(command) "counter" ' \
-              'FROM commands_list ' \
+        sql = 'SELECT bot_id, SUM(usage) "counter" ' \
+              'FROM commands_hourly ' \
               'WHERE command LIKE $1 AND guild_id=$2 ' \
               'GROUP BY bot_id ' \
               'ORDER BY counter DESC'
@@ -1455,7 +1686,11 @@ class FindBot(commands.Cog, name="Bots"):
         await menu.start(ctx)
 
     TASK_ID = 1001
+    # prefixes_list.prefix, commands_list.command and commands_hourly.command are VARCHAR(100)
+    MAX_NAME_LENGTH = 100
+    PREDICTION_TASK_ID = 1002
     EVERY_SEQUENCE = datetime.timedelta(days=45)
+    PREDICT_EVERY = datetime.timedelta(hours=6)
 
     async def task_handler(self):
         for count in itertools.count(1):
@@ -1466,29 +1701,76 @@ class FindBot(commands.Cog, name="Bots"):
                 print_exception("Error while executing task: ", e)
 
     async def execute_task_at(self):
-        data = await self.bot.pool_pg.fetchrow("SELECT * FROM bot_tasks WHERE task_id=$1", self.TASK_ID)
+        await self.execute_scheduled(self.TASK_ID, self.EVERY_SEQUENCE, self.on_purge_old_pending)
+
+    async def execute_scheduled(self, task_id: int, every: datetime.timedelta,
+                                task: Callable[[], Awaitable[Any]]) -> None:
+        """Runs the task when it is due according to bot_tasks, then sleeps until the next execution. The schedule is
+           stored, so a task that became due while the bot was offline runs right away."""
+        data = await self.bot.pool_pg.fetchrow("SELECT * FROM bot_tasks WHERE task_id=$1", task_id)
         current = datetime.datetime.now(datetime.timezone.utc)
         if not data:
             query = "INSERT INTO bot_tasks VALUES ($1, $2, $3)"
-            next_time = current + self.EVERY_SEQUENCE
-            await self.bot.pool_pg.execute(query, self.TASK_ID, current, next_time)
-            await self.on_purge_old_pending()
+            next_time = current + every
+            await self.bot.pool_pg.execute(query, task_id, current, next_time)
+            await task()
         else:
             exec_time = data["next_execution"]
             if exec_time <= current:
-                next_time = current + self.EVERY_SEQUENCE
+                next_time = current + every
                 query = "UPDATE bot_tasks SET last_execution=$1, next_execution=$2 WHERE task_id=$3"
-                await self.bot.pool_pg.execute(query, current, next_time, self.TASK_ID)
-                await self.on_purge_old_pending()
+                await self.bot.pool_pg.execute(query, current, next_time, task_id)
+                await task()
             else:
                 next_time = exec_time
 
         await discord.utils.sleep_until(next_time)
 
+    async def prediction_handler(self):
+        """Refreshes predicted_prefix every PREDICT_EVERY, scheduled through bot_tasks so frequent restarts don't keep
+           pushing the next run back."""
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await self.execute_scheduled(self.PREDICTION_TASK_ID, self.PREDICT_EVERY, self.refresh_predictions)
+            except Exception as e:
+                print_exception("Error while predicting prefixes: ", e)
+                await asyncio.sleep(60)
+
+    async def refresh_predictions(self) -> None:
+        amount = await self.predict_all_prefixes()
+        print(f"Predicted the prefix of {amount:,} bots.")
+
+    async def predict_all_prefixes(self) -> int:
+        """Predicts the prefix of every bot in position_summary with one forward pass and stores them."""
+        query = """
+            SELECT bot_id, letter, position, (count::FLOAT) / (total::FLOAT) "percentage"
+            FROM position_summary
+            ORDER BY bot_id, position
+        """
+        records = await self.bot.pool_pg.fetch(query)
+        batch = {bot_id: [*rows] for bot_id, rows in itertools.groupby(records, key=operator.itemgetter("bot_id"))}
+        predicted = await self.bot.derivative_prefix_neural.predict_many(batch)
+        now = datetime.datetime.utcnow()
+        values = [(bot_id, prefix, [letter for letter, _ in raw_data], [c for _, c in raw_data], now)
+                  for bot_id, (prefix, raw_data) in predicted.items()]
+        query = "INSERT INTO predicted_prefix VALUES($1, $2, $3, $4, $5) " \
+                "ON CONFLICT (bot_id) DO UPDATE SET prefix=EXCLUDED.prefix, letters=EXCLUDED.letters, " \
+                "confidences=EXCLUDED.confidences, predicted_at=EXCLUDED.predicted_at"
+        await self.bot.pool_pg.executemany(query, values)
+        return len(values)
+
     async def on_purge_old_pending(self):
         far_time = datetime.datetime.utcnow() - self.EVERY_SEQUENCE
         await self.bot.pool_pg.execute("DELETE FROM pending_bots WHERE requested_at <= $1", far_time)
 
 
+    def cog_unload(self) -> None:
+        self.response_collector.close()
+        self.prediction_task.cancel()
+        for name in "commands_list", "prefixes_list", "position_letter":
+            self.bot.remove_write_buffer(name)
+
+
 def setup(bot: StellaBot) -> None:
     bot.add_cog(FindBot(bot))
@@ -14,6 +14,7 @@ from discord.ext import commands
 from discord.ext.commands import Greedy
 from utils import greedy_parser
 from utils.decorators import event_check, pages
+from utils.executors import executor_stats
 from utils.useful import call, empty_page_format, print_exception, StellaContext, StellaEmbed, aware_utc
 from utils.buttons import InteractionPages
 from utils.greedy_parser import GreedyParser, Separator, UntilFlag
@@ -491,6 +492,12 @@ class Myself(commands.Cog):
             json.dump(bot_var, w, indent=4)
         await ctx.confirmed()
 
+    @commands.command(help="Shows the queue wait and run time of each executor.")
+    async def executors(self, ctx: StellaContext):
+        rows = [{"name": name, **{k: round(v, 2) for k, v in stats.items()}} for name, stats in executor_stats().items()]
+        table = tabulate.tabulate(rows, 'keys', 'pretty')
+        await ctx.maybe_reply(f"```py\n{table}```")
+
     @commands.command()
     async def cancel(self, ctx: StellaContext, message: Union[discord.Message, discord.Object]):
         with contextlib.suppress(KeyError):
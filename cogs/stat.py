@@ -1,12 +1,13 @@
 from __future__ import annotations
 import datetime
+import math
 import discord
 import matplotlib
-import io
+import numpy as np
 from typing import Union, Literal, TYPE_CHECKING
 from utils import flags as flg
 from utils.greedy_parser import UntilFlag, command
-from utils.image_manipulation import get_majority_color, islight, create_graph, process_image, create_bar
+from utils.image_manipulation import islight, create_graph, process_image, create_bar
 from utils.new_converters import TimeConverter, IsBot
 from utils.useful import StellaContext
 from discord.ext import commands
@@ -53,6 +54,10 @@ class Stat(commands.Cog, name="Statistic"):
     @flg.add_flag("--color", "--colour", "-C", type=discord.Color, default=None, 
                   help="Changes the graph's color depending on the hex given. "
                        "This defaults to the bot's avatar color, or if it's too dark, pink color, cause i like pink.")
+    @flg.add_flag("--bucket", "-B", type=int, default=10,
+                  help="The amount of points on the graph, this flag must be between 3 and 100. Each point can't be "
+                       "more precise than an hour, so it is lowered to the amount of hours given. Defaults to 10 "
+                       "when not given.")
     @commands.cooldown(1, 30, commands.BucketType.user)
     async def botactivity(self, ctx: StellaContext, member: UntilFlag[Union[Literal["guild", "me"], IsBot]],
                           **flags: Union[datetime.datetime, bool, discord.Color]):
@@ -60,15 +65,24 @@ class Stat(commands.Cog, name="Statistic"):
         if isinstance(target, str):
             target = await ElseConverter().convert(ctx, target)
 
+        if not 3 <= (bucket := flags.get("bucket")) <= 100:
+            raise commands.CommandError("Bucket flag must be between 3 and 100.")
+
         time_rn = datetime.datetime.utcnow()
         time_given = flags.get("time") or time_rn - datetime.timedelta(days=2)
+        # The rollup is hourly, the hour that contains time_given is counted from it's start
+        time_given = time_given.replace(minute=0, second=0, microsecond=0)
         if isinstance(target, discord.Member):
-            query = "SELECT * FROM commands_list WHERE guild_id=$1 AND bot_id=$2 AND time_used > $3"
+            query = "SELECT hour_used, SUM(usage) AS usage FROM commands_hourly " \
+                    "WHERE guild_id=$1 AND bot_id=$2 AND hour_used >= $3 " \
+                    "GROUP BY hour_used"
             values = (ctx.guild.id, target.id, time_given)
             error = "Looks like no data is present for this bot."
             method = "display_avatar"
         else:
-            query = "SELECT * FROM commands_list WHERE guild_id=$1 AND time_used > $2"
+            query = "SELECT hour_used, SUM(usage) AS usage FROM commands_hourly " \
+                    "WHERE guild_id=$1 AND hour_used >= $2 " \
+                    "GROUP BY hour_used"
             values = (target.id, time_given)
             error = "Looks like i dont know anything in this server."
             method = "icon"
@@ -76,45 +90,44 @@ class Stat(commands.Cog, name="Statistic"):
         data = await self.bot.pool_pg.fetch(query, *values)
         if not data:
             raise commands.CommandError(error)
-        bot_based_time = {}
         total_seconds = (time_rn - time_given).total_seconds()
-        each_time = datetime.timedelta(seconds=total_seconds / 10)
-        for each in range(1, 11):
-            within_time = []
-            after = time_rn - each_time * (each - 1)
-            before = time_rn - each_time * each
-            for row in data:
-                if before < row["time_used"] < after:
-                    within_time.append(row)
-
-            bot_based_time.update({before: len(within_time)})
+        bucket = min(bucket, max(3, math.ceil(total_seconds / 3600)))
+        each_time = datetime.timedelta(seconds=total_seconds / bucket)
+        hours = np.array([row["hour_used"] for row in data], dtype="datetime64[s]").astype(np.int64)
+        usages = np.array([row["usage"] for row in data], dtype=np.int64)
+        start, end = (np.datetime64(t, "s").astype(np.int64) for t in (time_given, time_rn))
+        within_time, _ = np.histogram(hours, bins=np.linspace(start, end, bucket + 1), weights=usages)
 
-        x = list(bot_based_time)
-        y = list(bot_based_time.values())
+        # Latest bucket comes first, each labelled by the start of the bucket
+        x = [time_rn - each_time * each for each in range(1, bucket + 1)]
+        y = within_time[::-1].astype(int).tolist()
 
         asset = getattr(target, method)
-        async with ctx.typing():
-            avatar_bytes = io.BytesIO(await asset.read())
-            if not flags.get("color"):
-                new_color = major = await get_majority_color(avatar_bytes)
-                if not islight(*major.to_rgb()) or member == ctx.me:
-                    new_color = discord.Color(ctx.bot.color)
-                flags["color"] = new_color
-
-            graph = await create_graph(x, y, **flags)
-            to_send = await process_image(avatar_bytes, graph)
+        chart_cache = self.bot.chart_cache
+        # Labels only shows the date, the time is rounded so the same graph can be reused within the hour
+        rounded = [d.replace(minute=0, second=0, microsecond=0) for d in x]
+        key = chart_cache.make_key("graph", rounded, y, asset.key, member == ctx.me,
+                                   str(flags.get("color")), flags.get("smooth"))
+        if (to_send := await chart_cache.get(key)) is None:
+            async with ctx.typing():
+                avatar_bytes = await self.bot.avatar_cache.read(asset)
+                if not flags.get("color"):
+                    new_color = major = await self.bot.avatar_cache.get_color(asset)
+                    if not islight(*major.to_rgb()) or member == ctx.me:
+                        new_color = discord.Color(ctx.bot.color)
+                    flags["color"] = new_color
+
+                graph = await create_graph(x, y, **flags)
+                to_send = await chart_cache.put(key, await process_image(avatar_bytes, graph))
+            graph.close()
+            avatar_bytes.close()
+
         embed = discord.Embed()
         embed.set_image(url="attachment://picture.png")
         embed.set_author(name=target, icon_url=asset)
         await ctx.embed(embed=embed, file=discord.File(to_send, filename="picture.png"))
-        graph.close()
-        avatar_bytes.close()
         to_send.close()
 
-        del graph
-        del avatar_bytes
-        del to_send
-
     @command(aliases=["topcommand", "tc", "tcs"],
              help="Generate a bar graph for 10 most used command for a bot.")
     @commands.guild_only()
@@ -126,7 +139,7 @@ class Stat(commands.Cog, name="Statistic"):
                           **flags: discord.Color):
         target = member
         if isinstance(target, discord.Member):
-            query = "SELECT command, COUNT(command) AS usage FROM commands_list " \
+            query = "SELECT command, SUM(usage) AS usage FROM commands_hourly " \
                     "WHERE guild_id=$1 AND bot_id=$2 " \
                     "GROUP BY bot_id, command " \
                     "ORDER BY usage DESC LIMIT 10"
@@ -135,7 +148,7 @@ class Stat(commands.Cog, name="Statistic"):
             method = "display_avatar"
         else:
             target = await ElseConverter().convert(ctx, target)
-            query = "SELECT command, COUNT(command) AS usage FROM commands_list " \
+            query = "SELECT command, SUM(usage) AS usage FROM commands_hourly " \
                     "WHERE guild_id=$1 " \
                     "GROUP BY command " \
                     "ORDER BY usage DESC LIMIT 10;"
@@ -155,22 +168,25 @@ class Stat(commands.Cog, name="Statistic"):
                        ylabel="Commands")
 
         asset = getattr(target, method)
-        async with ctx.typing():
-            avatar_bytes = io.BytesIO(await asset.read())
-            if not (color := flags.get("color")):
-                color = major = await get_majority_color(avatar_bytes)
-                if not islight(*major.to_rgb()) or member == ctx.me:
-                    color = discord.Color(ctx.bot.color)
-
-            bar = await create_bar(names, usages, str(color), **payload)
-            to_send = await process_image(avatar_bytes, bar)
+        chart_cache = self.bot.chart_cache
+        key = chart_cache.make_key("bar", names, usages, asset.key, member == ctx.me, str(flags.get("color")), payload)
+        if (to_send := await chart_cache.get(key)) is None:
+            async with ctx.typing():
+                avatar_bytes = await self.bot.avatar_cache.read(asset)
+                if not (color := flags.get("color")):
+                    color = major = await self.bot.avatar_cache.get_color(asset)
+                    if not islight(*major.to_rgb()) or member == ctx.me:
+                        color = discord.Color(ctx.bot.color)
+
+                bar = await create_bar(names, usages, str(color), **payload)
+                to_send = await chart_cache.put(key, await process_image(avatar_bytes, bar))
+            bar.close()
+            avatar_bytes.close()
 
         embed = discord.Embed()
         embed.set_image(url="attachment://picture.png")
         embed.set_author(name=target, icon_url=asset)
         await ctx.embed(embed=embed, file=discord.File(to_send, filename="picture.png"))
-        bar.close()
-        avatar_bytes.close()
         to_send.close()
 
 
@@ -11,13 +11,17 @@ import humanize
 import json
 import numpy as np
 import collections
+import functools
 from aiogithub import GitHub
 from typing import Union, List, Optional
 
 from utils.context_managers import UserLock
+from utils.buffers import WriteBehindBuffer
+from utils.image_manipulation import ChartCache, AvatarCache, render_pool
 from utils.prefix_ai import PrefixNeuralNetwork, DerivativeNeuralNetwork
-from utils.useful import StellaContext, ListCall, count_python
+from utils.useful import StellaContext, ListCall, PrefixCache, PrefixScoreCache, count_python
 from utils.decorators import event_check, wait_ready, in_executor
+from utils.executors import configure_executors, shutdown_executors
 from utils.ipc import StellaClient
 from discord.ext import commands
 from dotenv import load_dotenv
@@ -32,6 +36,14 @@ load_dotenv(dotenv_path)
 import utils.library_override
 
 to_call = ListCall()
+MISSING = discord.utils.MISSING
+MENTION_REGEX = re.compile("<@(!)?661466532605460530>")
+
+
+@functools.lru_cache(maxsize=512)
+def compile_prefix(prefix: str) -> re.Pattern:
+    """Case insensitive matcher of a prefix, guilds sharing a prefix share the same pattern."""
+    return re.compile(f"^({re.escape(prefix)})", flags=re.I)
 
 
 class StellaBot(commands.Bot):
@@ -57,29 +69,33 @@ class StellaBot(commands.Bot):
         self.token = kwargs.pop("token", None)
         self.blacklist = set()
         self.cached_users = {}
-        self.existing_prefix = {}
+        self.existing_prefix = PrefixCache(maxsize=kwargs.pop("prefix_cache_size", None) or 10000)
+        self.prefix_scores = PrefixScoreCache()
         self.cached_context = collections.deque(maxlen=100)
         self.command_running = {}
         self.user_lock = {}
+        self.write_buffers = {}
+        self.chart_cache = ChartCache(directory=kwargs.pop("chart_cache_dir", None))
+        self.avatar_cache = AvatarCache(self)
+        self.render_pool = render_pool.configure(
+            backend=kwargs.pop("render_backend", None),
+            workers=kwargs.pop("render_workers", None),
+            max_queue=kwargs.pop("render_queue", None)
+        )
+        configure_executors(kwargs.pop("executor_workers", None))
         super().__init__(self.get_prefix, **kwargs)
 
         kweights = kwargs.pop("prefix_weights")
         self.prefix_neural_network = PrefixNeuralNetwork.from_weight(*kweights.values())
-        self.derivative_prefix_neural = DerivativeNeuralNetwork(kwargs.pop("prefix_derivative"))
-
-    @in_executor()
-    def get_prefixes_dataset(self, data: List[List[Union[int, str]]]) -> np.array:
-        """Get a list of prefixes from database and calculated through Neural Network"""
-        inputs = np.array(data)
-        amounts, epoch_times = inputs[:, 1].astype(np.int32), inputs[:, 2].astype(np.float)
-
-        # Normalize datasets into between 0 - 1 for ANN
-        # This is done by getting the the current value divided by highest value
-        normalized_amount, normalized_epoch = amounts / amounts.max(), epoch_times / epoch_times.max()
-        normalized = np.dstack((normalized_amount, normalized_epoch))
-        result = self.prefix_neural_network.fit(normalized) * 200
-        predicted = np.column_stack((inputs, result.flat[::]))
-        return predicted
+        self.derivative_prefix_neural = DerivativeNeuralNetwork(
+            kwargs.pop("prefix_derivative"), engine=kwargs.pop("prefix_derivative_engine", None) or "keras"
+        )
+        self.derivative_warm_up = kwargs.pop("prefix_derivative_warm_up", False)
+
+    @in_executor("cpu")
+    def score_prefixes(self, usage: np.array, last_usage: np.array, offsets: Optional[np.array] = None) -> np.array:
+        """Scores prefix usage through the Neural Network, each group is normalized against it's own highest value."""
+        return self.prefix_neural_network.score(usage, last_usage, offsets)
 
     async def add_blacklist(self, snowflake_id, reason):
         timed = datetime.datetime.utcnow()
@@ -107,7 +123,7 @@ class StellaBot(commands.Bot):
         return self.help_command.get_command_signature(command, ctx)
 
     async def after_db(self) -> None:
-        """Runs after the db is connected"""
+        """Runs after the db is connected, every preload runs concurrently with the cog loading."""
         await to_call.call(self)
 
     def add_command(self, command: commands.Command) -> None:
@@ -119,6 +135,22 @@ class StellaBot(commands.Bot):
     def add_user_lock(self, lock: UserLock):
         self.user_lock.update({lock.user.id: lock})
 
+    def add_write_buffer(self, name: str, buffer: WriteBehindBuffer) -> WriteBehindBuffer:
+        self.write_buffers.update({name: buffer.start()})
+        return buffer
+
+    def remove_write_buffer(self, name: str) -> Optional[WriteBehindBuffer]:
+        if buffer := self.write_buffers.pop(name, None):
+            self.loop.create_task(buffer.close())
+        return buffer
+
+    async def close(self) -> None:
+        """Flushes every write behind buffer before closing, any rows left would be lost otherwise."""
+        await asyncio.gather(*(buffer.close() for buffer in self.write_buffers.values()))
+        self.render_pool.close()
+        shutdown_executors()
+        await super().close()
+
     async def check_user_lock(self, user: Union[discord.Member, discord.User]):
         if lock := self.user_lock.get(user.id):
             if lock.locked():
@@ -186,6 +218,8 @@ class StellaBot(commands.Bot):
     async def after_ready(self):
         await self.wait_until_ready()
         self.add_view(PersistentRespondView(self))
+        if self.derivative_warm_up:
+            self.derivative_prefix_neural.warm_up()
         await self.greet_server()
 
     async def greet_server(self):
@@ -237,16 +271,30 @@ class StellaBot(commands.Bot):
         if self.tester:
             return "+="
 
-        if not (prefix := self.existing_prefix.get(snowflake_id)):
+        if (prefix := self.existing_prefix.get(snowflake_id)) is None:
             data = await self.pool_pg.fetchrow(query, snowflake_id) or {}
-            prefix = self.existing_prefix.setdefault(snowflake_id, data.get("prefix") or "uwu ")
+            prefix = self.existing_prefix.set(snowflake_id, data.get("prefix"))
 
-        comp = re.compile(f"^({re.escape(prefix)}).*", flags=re.I)
-        match = comp.match(message.content)
+        match = compile_prefix(prefix).match(message.content)
         if match is not None:
             return match.group(1)
         return prefix
 
+    async def invalidate_prefix(self, snowflake_id: int, prefix: Optional[str] = MISSING) -> None:
+        """Updates the cached prefix of a guild or user. Without a prefix, the changed row is fetched right away, which
+           keeps the cache complete."""
+        if prefix is MISSING:
+            query = "SELECT prefix FROM internal_prefix WHERE snowflake_id=$1"
+            prefix = await self.pool_pg.fetchval(query, snowflake_id)
+        self.existing_prefix.set(snowflake_id, prefix)
+
+    @to_call.append
+    async def fill_prefixes(self) -> None:
+        """Warms the prefix cache with every custom prefix."""
+        records = await self.pool_pg.fetch("SELECT snowflake_id, prefix FROM internal_prefix")
+        self.existing_prefix.load((r["snowflake_id"], r["prefix"]) for r in records)
+        print(f"Prefix cache is now filled with {len(records):,} prefixes.")
+
     def get_message(self, message_id: int) -> discord.Message:
         """Gets the message from the cache"""
         return self._connection._get_message(message_id)
@@ -263,6 +311,12 @@ class StellaBot(commands.Bot):
         if message.author.bot:
             return
 
+        # Plain chat never starts with the prefix, no context is needed for them
+        snowflake_id = message.guild.id if message.guild else message.author.id
+        if not self.tester and (prefix := self.existing_prefix.get(snowflake_id)) is not None:
+            if message.content[:1].lower() != prefix[:1].lower():
+                return
+
         ctx = await self.get_context(message)
         if ctx.valid and getattr(ctx.cog, "qualified_name", None) != "Jishaku":
             await ctx.trigger_typing()
@@ -285,6 +339,7 @@ class StellaBot(commands.Bot):
             self.pool_pg = pool_pg
             print(f"Connected to the database ({time.time() - start})s")
             self.loop.run_until_complete(self.after_db())
+            self.render_pool.start()
             self.loop.create_task(self.after_ready())
             self.run(self.token)
 
@@ -308,7 +363,15 @@ bot_data = {
     "websocket_ip": states.get("WEBSOCKET_IP"),
     "prefix_weights": states.get("PREFIX_WEIGHT"),
     "prefix_derivative": states.get("PREFIX_DERIVATIVE_PATH"),
+    "prefix_derivative_warm_up": states.get("PREFIX_DERIVATIVE_WARM_UP"),
+    "prefix_derivative_engine": states.get("PREFIX_DERIVATIVE_ENGINE"),
     "git_token": states.get("GIT_TOKEN"),
+    "chart_cache_dir": states.get("CHART_CACHE_DIR"),
+    "prefix_cache_size": states.get("PREFIX_CACHE_SIZE"),
+    "render_backend": states.get("RENDER_BACKEND"),
+    "render_workers": states.get("RENDER_WORKERS"),
+    "render_queue": states.get("RENDER_QUEUE"),
+    "executor_workers": states.get("EXECUTOR_WORKERS"),
     "activity": discord.Activity(type=discord.ActivityType.listening, name="logged to my pc."),
     "description": "{}'s personal bot that is partially for the public. "
                    f"Written with only `{count_python('.'):,}` lines. plz be nice"
@@ -336,7 +399,7 @@ async def on_connect():
 @wait_ready(bot=bot)
 @event_check(lambda m: not bot.tester or m.author == bot.stella)
 async def on_message(message):
-    if re.fullmatch("<@(!)?661466532605460530>", message.content):
+    if message.content.startswith("<@") and MENTION_REGEX.fullmatch(message.content):
         await message.channel.send(f"My prefix is `{await bot.get_prefix(message)}`")
         return
 
@@ -378,6 +441,12 @@ async def on_restarting_server(data):
     print("Server Connection Successful.")
 
 
+@bot.ipc_client.listen()
+async def on_prefix_update(data):
+    snowflake_id = data["snowflake_id"]
+    await bot.invalidate_prefix(snowflake_id, data.get("prefix", MISSING))
+
+
 @bot.ipc_client.listen()
 async def on_kill(data):
     print("Kill has been ordered", data)
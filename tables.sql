@@ -9,6 +9,23 @@ CREATE TABLE commands_list(
      command VARCHAR(100) NOT NULL,
      time_used TIMESTAMP);
 
+CREATE TABLE commands_hourly(
+     guild_id BIGINT NOT NULL,
+     bot_id BIGINT NOT NULL,
+     command VARCHAR(100) NOT NULL,
+     hour_used TIMESTAMP NOT NULL,
+     usage INTEGER NOT NULL,
+     PRIMARY KEY(guild_id, bot_id, command, hour_used));
+
+CREATE INDEX commands_hourly_guild_hour ON commands_hourly(guild_id, hour_used);
+
+-- Backfills the rollup from commands_list rows that were written before commands_hourly existed.
+INSERT INTO commands_hourly
+     SELECT guild_id, bot_id, command, date_trunc('hour', time_used), COUNT(*)
+     FROM commands_list
+     GROUP BY 1, 2, 3, 4
+     ON CONFLICT DO NOTHING;
+
 CREATE TABLE prefixes_list(
      guild_id BIGINT NOT NULL,
      bot_id BIGINT NOT NULL,
@@ -67,6 +84,23 @@ CREATE TABLE position_letter(
      PRIMARY KEY(bot_id, letter, "position")
 );
 
+CREATE TABLE position_summary(
+     bot_id BIGINT NOT NULL,
+     position INT NOT NULL,
+     letter CHAR NOT NULL,
+     count INT NOT NULL,
+     total INT NOT NULL,
+     PRIMARY KEY(bot_id, "position")
+);
+
+-- Backfills the most used letter and the total of each position from position_letter.
+INSERT INTO position_summary
+     SELECT DISTINCT ON (bot_id, position) bot_id, position, letter, count,
+            SUM(count) OVER (PARTITION BY bot_id, position)
+     FROM position_letter
+     ORDER BY bot_id, position, count DESC
+     ON CONFLICT DO NOTHING;
+
 CREATE TABLE internal_prefix(
      snowflake_id BIGINT UNIQUE,
      prefix VARCHAR(30)
@@ -76,4 +110,17 @@ CREATE TABLE bot_tasks(
      task_id SERIAL PRIMARY KEY,
      last_execution TIMESTAMP WITH TIME ZONE,
      next_execution TIMESTAMP WITH TIME ZONE
+);
+
+CREATE TABLE avatar_colors(
+     avatar_key VARCHAR(100) PRIMARY KEY,
+     color INTEGER NOT NULL
+);
+
+CREATE TABLE predicted_prefix(
+     bot_id BIGINT PRIMARY KEY,
+     prefix VARCHAR(30) NOT NULL,
+     letters VARCHAR(1)[] NOT NULL,
+     confidences REAL[] NOT NULL,
+     predicted_at TIMESTAMP NOT NULL
 );
\ No newline at end of file
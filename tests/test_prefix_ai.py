@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from utils.prefix_ai import DerivativeNeuralNetwork, NumpyDerivativeModel
+
+pytest.importorskip("tensorflow")
+
+
+def test_numpy_engine_matches_keras(tmp_path):
+    network = DerivativeNeuralNetwork(str(tmp_path / "derivative.weights.h5"))
+    size = network.input_output_size
+    rng = np.random.default_rng(0)
+
+    model = network.build_model()
+    model.layers[0].adapt(rng.random((64, size), dtype=np.float32))
+    model.save_weights(network.path)
+
+    destination = str(tmp_path / "derivative.npz")
+    network.export_numpy(destination)
+    x = rng.random((16, size), dtype=np.float32)
+    expected = network.model.predict(x, verbose=0)
+    assert np.allclose(NumpyDerivativeModel.load(destination).predict(x), expected, atol=1e-5)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar, Union
+from utils.useful import print_exception
+
+T = TypeVar("T")
+
+
+class WriteBehindBuffer(Generic[T]):
+    """Accumulates rows in memory and hands them to flush_callback in one go. A flush happens when the buffer reaches
+       max_size, every interval seconds, or when the buffer closes."""
+    def __init__(self, flush_callback: Callable[[List[T]], Awaitable[Any]], *, max_size: Optional[int] = 500,
+                 interval: Optional[float] = 10, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.flush_callback = flush_callback
+        self.max_size = max_size
+        self.interval = interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.pending = self.create_pending()
+        self.lock = asyncio.Lock()
+        self.flushing = None
+        self.task = None
+
+    def create_pending(self) -> Union[List[T], Dict[Hashable, T]]:
+        return []
+
+    def add(self, row: T) -> None:
+        self.pending.append(row)
+        self.check_size()
+
+    def extend(self, rows: List[T]) -> None:
+        for row in rows:
+            self.add(row)
+
+    def check_size(self) -> None:
+        if len(self.pending) >= self.max_size and (self.flushing is None or self.flushing.done()):
+            self.flushing = self.loop.create_task(self.flush())
+
+    def rows(self, pending: Union[List[T], Dict[Hashable, T]]) -> List[T]:
+        return pending
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    async def flush(self) -> None:
+        """Hands every pending row to the flush_callback. Only the rows that fail on their own are dropped."""
+        async with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, self.create_pending()
+            rows = self.rows(pending)
+            if failed := await self.write(rows):
+                row, error = failed[0]
+                print_exception(f"Dropped {len(failed)} of {len(rows)} row(s) while flushing, first was {row!r}:", error)
+
+    async def write(self, rows: List[T]) -> List[Tuple[T, Exception]]:
+        """Calls flush_callback, a failed batch is split in half and retried. A single row that can never be written
+           then only loses itself instead of the whole batch. Returns every row that failed with it's exception."""
+        try:
+            await self.flush_callback(rows)
+        except Exception as e:
+            if len(rows) == 1:
+                return [(rows[0], e)]
+            middle = len(rows) // 2
+            return [*await self.write(rows[:middle]), *await self.write(rows[middle:])]
+        return []
+
+    async def flush_every(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> WriteBehindBuffer[T]:
+        if self.task is None:
+            self.task = self.loop.create_task(self.flush_every())
+        return self
+
+    async def close(self) -> None:
+        """Stops the interval flush and flush whatever is left."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+
+class AggregateBuffer(WriteBehindBuffer[T]):
+    """WriteBehindBuffer that combines rows with the same key before they are flushed."""
+    def __init__(self, flush_callback: Callable[[List[T]], Awaitable[Any]], *, key: Callable[[T], Hashable],
+                 combine: Callable[[T, T], T], **kwargs: Any):
+        self.key = key
+        self.combine = combine
+        super().__init__(flush_callback, **kwargs)
+
+    def create_pending(self) -> Dict[Hashable, T]:
+        return {}
+
+    def add(self, row: T) -> None:
+        key = self.key(row)
+        if (current := self.pending.get(key)) is not None:
+            row = self.combine(current, row)
+        self.pending[key] = row
+        self.check_size()
+
+    def rows(self, pending: Dict[Hashable, T]) -> List[T]:
+        return [*pending.values()]
@@ -6,6 +6,7 @@ from typing import Callable, Optional, Any, Union, Coroutine, Type, Iterable, TY
 from utils.menus import MenuBase
 from discord.ext import commands, menus
 from utils.errors import NotInDpy
+from utils.executors import get_executor
 
 if TYPE_CHECKING:
     from main import StellaBot
@@ -76,14 +77,15 @@ def listen_for_guilds() -> Callable:
     return event_check(predicate)
 
 
-def in_executor(loop: Optional[asyncio.AbstractEventLoop] = None) -> Callable[..., Coroutine[Any, Any, Any]]:
-    """Makes a sync blocking function unblocking"""
-    loop = loop or asyncio.get_event_loop()
+def in_executor(executor: Optional[str] = "cpu", *,
+                loop: Optional[asyncio.AbstractEventLoop] = None) -> Callable[..., Coroutine[Any, Any, Any]]:
+    """Makes a sync blocking function unblocking, running it in the named executor from utils.executors. The loop
+       is resolved on every call unless given, so this is safe to use at import time."""
+    get_executor(executor)
 
     def inner_function(func: Callable) -> Callable:
         @functools.wraps(func)
         def function(*args: Any, **kwargs: Any) -> Coroutine:
-            partial = functools.partial(func, *args, **kwargs)
-            return loop.run_in_executor(None, partial)
+            return get_executor(executor).submit(loop or asyncio.get_running_loop(), func, *args, **kwargs)
         return function
     return inner_function
@@ -85,3 +85,8 @@ class BypassError(ArgumentBaseError):
     def __init__(self, error):
         super().__init__()
         self.original = error
+
+
+class RenderBusy(commands.CommandError):
+    def __init__(self):
+        super().__init__(message="Too many graphs are being generated right now, try again in a bit.")
@@ -0,0 +1,109 @@
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ExecutorStats:
+    """Timing of every job that went through a NamedExecutor. Queue wait is the time between the submit and the job
+       starting in a worker, run time is how long the job itself took."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.queue_wait = 0.
+        self.run_time = 0.
+        self.max_queue_wait = 0.
+        self.max_run_time = 0.
+
+    def record(self, queue_wait: float, run_time: float) -> None:
+        with self.lock:
+            self.count += 1
+            self.queue_wait += queue_wait
+            self.run_time += run_time
+            self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+            self.max_run_time = max(self.max_run_time, run_time)
+
+    def to_dict(self) -> Dict[str, float]:
+        with self.lock:
+            count = self.count or 1
+            return {
+                "jobs": self.count,
+                "avg_wait_ms": self.queue_wait / count * 1000,
+                "max_wait_ms": self.max_queue_wait * 1000,
+                "avg_run_ms": self.run_time / count * 1000,
+                "max_run_ms": self.max_run_time * 1000,
+            }
+
+
+class NamedExecutor:
+    """Thread pool with a fixed amount of workers, so a slow kind of job can only ever occupy it's own pool.
+       The pool is created on the first submit, which allows the size to be configured before that."""
+    def __init__(self, name: str, *, workers: Optional[int] = 2):
+        self.name = name
+        self.workers = workers
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.stats = ExecutorStats()
+        self.pending = 0
+
+    def get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix=f"stella-{self.name}")
+        return self.executor
+
+    def submit(self, loop: asyncio.AbstractEventLoop, func: Callable[..., T], *args: Any,
+               **kwargs: Any) -> asyncio.Future:
+        queued = time.perf_counter()
+
+        def run() -> T:
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stats.record(started - queued, time.perf_counter() - started)
+
+        def done(_: asyncio.Future) -> None:
+            self.pending -= 1
+
+        self.pending += 1
+        future = loop.run_in_executor(self.get_executor(), run)
+        future.add_done_callback(done)
+        return future
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+executors: Dict[str, NamedExecutor] = {
+    name: NamedExecutor(name, workers=workers)
+    for name, workers in (("cpu", 4), ("render", 2), ("ml", 1), ("match", 2))
+}
+
+
+def get_executor(name: str) -> NamedExecutor:
+    if (executor := executors.get(name)) is None:
+        raise KeyError(f"No executor named {name!r}. Available: {', '.join(executors)}.")
+    return executor
+
+
+def configure_executors(sizes: Optional[Dict[str, int]] = None) -> None:
+    """Resize or add executors, this only affects an executor that has not started yet."""
+    for name, workers in (sizes or {}).items():
+        if (executor := executors.get(name)) is None:
+            executors[name] = NamedExecutor(name, workers=workers)
+        else:
+            executor.workers = workers
+
+
+def executor_stats() -> Dict[str, Dict[str, float]]:
+    return {name: {"workers": e.workers, "pending": e.pending, **e.stats.to_dict()} for name, e in executors.items()}
+
+
+def shutdown_executors() -> None:
+    for executor in executors.values():
+        executor.shutdown()
@@ -1,7 +1,16 @@
+from __future__ import annotations
+import asyncio
+import collections
+import concurrent.futures
 import datetime
+import functools
+import hashlib
 import io
 import math
-from typing import Coroutine, Any, List, Optional
+import multiprocessing
+import os
+import time
+from typing import Callable, Coroutine, Dict, Any, List, Optional, Tuple
 
 import discord
 from PIL import Image, ImageEnhance, ImageFilter
@@ -17,6 +26,211 @@ from matplotlib.patches import Polygon
 from scipy.interpolate import make_interp_spline
 
 from utils.decorators import in_executor
+from utils.errors import RenderBusy
+from utils.executors import get_executor
+
+renderers: Dict[str, Callable[..., io.BytesIO]] = {}
+
+
+class ChartCache:
+    """Bounded LRU cache of rendered PNG bytes that expires after ttl seconds. When a directory is given, every chart
+       is also written into it so it survives a restart, where the directory holds at most disk_maxsize charts. The
+       disk is only touched in the cpu executor, and it is pruned once every prune_every writes."""
+    def __init__(self, *, maxsize: Optional[int] = 128, ttl: Optional[float] = 600, directory: Optional[str] = None,
+                 disk_maxsize: Optional[int] = 1024, prune_every: Optional[int] = 32):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.disk_maxsize = disk_maxsize
+        self.prune_every = prune_every
+        self.writes = 0
+        self.entries: collections.OrderedDict[str, Tuple[float, bytes]] = collections.OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Hash every part that decides how the chart looks, such as values, color, avatar key and flags."""
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[io.BytesIO]:
+        if entry := self.entries.get(key):
+            created, data = entry
+            if created + self.ttl > time.time():
+                self.entries.move_to_end(key)
+                return io.BytesIO(data)
+            del self.entries[key]
+
+        if self.directory is not None:
+            loop = asyncio.get_running_loop()
+            if (entry := await get_executor("cpu").submit(loop, self.read_disk, key)) is None:
+                return
+            created, data = entry
+            self.store(key, data, created)
+            return io.BytesIO(data)
+
+    async def put(self, key: str, image: io.BytesIO) -> io.BytesIO:
+        """Stores the chart, the given buffer is returned untouched."""
+        data = image.getvalue()
+        self.store(key, data, time.time())
+        if self.directory is not None:
+            self.writes += 1
+            prune = self.writes % self.prune_every == 0
+            await get_executor("cpu").submit(asyncio.get_running_loop(), self.write_disk, key, data, prune)
+        return image
+
+    def store(self, key: str, data: bytes, created: float) -> None:
+        self.entries[key] = (created, data)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def read_disk(self, key: str) -> Optional[Tuple[float, bytes]]:
+        path = self.disk_path(key)
+        try:
+            created = os.path.getmtime(path)
+            if created + self.ttl <= time.time():
+                os.remove(path)
+                return
+            with open(path, "rb") as r:
+                return created, r.read()
+        except OSError:
+            return
+
+    def write_disk(self, key: str, data: bytes, prune: bool) -> None:
+        try:
+            with open(self.disk_path(key), "wb") as w:
+                w.write(data)
+            if prune:
+                self.prune_disk()
+        except OSError as e:
+            print(f"Unable to write chart {key} into the disk: {e}")
+
+    def prune_disk(self) -> None:
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".png")]
+        if len(files) <= self.disk_maxsize:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.disk_maxsize]:
+            os.remove(path)
+
+
+def warm_up() -> None:
+    """Runs once in every render worker, drawing an empty figure loads the backend and the font cache ahead of time."""
+    plt.switch_backend("Agg")
+    fig = plt.figure()
+    fig.savefig(io.BytesIO(), format="png")
+    plt.close(fig)
+
+
+def run_renderer(name: str, *args: Any, **kwargs: Any) -> bytes:
+    """Entry point inside a render worker. Only the renderer name is pickled, the image goes back as PNG bytes."""
+    return renderers[name](*args, **kwargs).getvalue()
+
+
+class RenderPool:
+    """Executor that renders charts away from the event loop. The process backend keeps matplotlib and PIL from
+       contending for the GIL with the gateway, the thread backend uses the "render" executor. Once max_queue
+       renders are pending, RenderBusy is raised instead of queueing more."""
+    def __init__(self, *, backend: Optional[str] = "process", workers: Optional[int] = 2,
+                 max_queue: Optional[int] = 8):
+        self.backend = backend
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.pending = 0
+
+    def configure(self, **kwargs: Any) -> RenderPool:
+        for key, value in kwargs.items():
+            if value is not None:
+                setattr(self, key, value)
+        return self
+
+    def start(self) -> RenderPool:
+        """Spawns every worker upfront so the first chart command does not pay for the start up."""
+        if self.backend not in ("process", "thread"):
+            raise ValueError(f"Unknown render backend {self.backend!r}.")
+        if self.backend == "process" and self.executor is None:
+            # Forked explicitly, under spawn or forkserver every worker would import main.py and start the bot again
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                int(self.workers), mp_context=multiprocessing.get_context("fork"), initializer=warm_up
+            )
+            for _ in range(int(self.workers)):
+                self.executor.submit(int)
+        return self
+
+    async def run(self, name: str, *args: Any, **kwargs: Any) -> io.BytesIO:
+        if self.pending >= self.max_queue:
+            raise RenderBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if self.executor is None:
+                data = await get_executor("render").submit(loop, run_renderer, name, *args, **kwargs)
+            else:
+                data = await loop.run_in_executor(self.executor, functools.partial(run_renderer, name, *args, **kwargs))
+            return io.BytesIO(data)
+        finally:
+            self.pending -= 1
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+render_pool = RenderPool()
+
+
+def render_task(func: Callable[..., io.BytesIO]) -> Callable[..., Coroutine[Any, Any, io.BytesIO]]:
+    """Registers the function as a renderer that runs in the render_pool. The function itself is looked up by name
+       inside the worker, since the decorated function can't be pickled."""
+    renderers.update({func.__name__: func})
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Coroutine[Any, Any, io.BytesIO]:
+        return render_pool.run(func.__name__, *args, **kwargs)
+    return wrapper
+
+
+class AvatarCache:
+    """Caches a downsized avatar and it's majority color keyed by the asset key, which only changes when the avatar
+       changes. Both are bounded by maxsize, the color is persisted in avatar_colors so an evicted color is only a query
+       away."""
+    def __init__(self, bot: Any, *, maxsize: Optional[int] = 256, size: Optional[int] = 256):
+        self.bot = bot
+        self.maxsize = maxsize
+        self.size = size
+        self.thumbnails: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+        self.colors: collections.OrderedDict[str, discord.Color] = collections.OrderedDict()
+
+    async def read(self, asset: discord.Asset) -> io.BytesIO:
+        """Reads the avatar downsized to size, this is enough for the blurred background in process_image."""
+        if (data := self.thumbnails.get(asset.key)) is None:
+            data = await asset.with_size(self.size).read()
+        self.store(self.thumbnails, asset.key, data)
+        return io.BytesIO(data)
+
+    async def get_color(self, asset: discord.Asset) -> discord.Color:
+        if (color := self.colors.get(asset.key)) is None:
+            query = "SELECT color FROM avatar_colors WHERE avatar_key=$1"
+            if (value := await self.bot.pool_pg.fetchval(query, asset.key)) is not None:
+                color = discord.Color(value)
+            else:
+                color = await get_majority_color(await self.read(asset))
+                query = "INSERT INTO avatar_colors VALUES($1, $2) ON CONFLICT (avatar_key) DO NOTHING"
+                await self.bot.pool_pg.execute(query, asset.key, color.value)
+        self.store(self.colors, asset.key, color)
+        return color
+
+    def store(self, entries: collections.OrderedDict[str, Any], key: str, value: Any) -> None:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
 
 
 def create_gradient_array(color: str, *, alpha_min: Optional[int] = 0, alpha_max: Optional[int] = 1) -> np.array:
@@ -26,7 +240,7 @@ def create_gradient_array(color: str, *, alpha_min: Optional[int] = 0, alpha_max
     return z
 
 
-@in_executor()
+@render_task
 def create_graph(x: List[datetime.datetime], y: List[int], **kwargs: int):
     color = str(kwargs.get("color"))
     fig, axes = plt.subplots()
@@ -96,7 +310,7 @@ def inverse_color(*rgb: int) -> List[int]:
     return [*map(lambda x: 255 - x, rgb)]
 
 
-@in_executor()
+@render_task
 def create_bar(x_val: List[Any], y_val: List[Any], color: str, **kwargs: Any) -> Coroutine[Any, Any, io.BytesIO]:
     h = len(x_val) * .48
     fig, axes = plt.subplots(figsize=(6.4, h))
@@ -158,7 +372,7 @@ def save_matplotlib(fig: Figure, axes: Axes) -> io.BytesIO:
     return buffer
 
 
-@in_executor()
+@render_task
 def process_image(avatar_bytes: io.BytesIO, target: io.BytesIO) -> Coroutine[Any, Any, io.BytesIO]:
     with Image.open(avatar_bytes).convert('RGBA') as avatar, Image.open(target) as target:
         side = max(avatar.size)
@@ -181,7 +395,7 @@ def process_image(avatar_bytes: io.BytesIO, target: io.BytesIO) -> Coroutine[Any
         return to_send
 
 
-@in_executor()
+@in_executor("render")
 def get_majority_color(b: io.BytesIO) -> Coroutine[Any, Any, discord.Color]:
     with Image.open(b) as target:
         smol = target.quantize(4)
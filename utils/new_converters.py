@@ -88,35 +88,65 @@ class BotData:
         return self.bot.id
 
 
+def prefix_arrays(data: List[Any]) -> Tuple[np.array, np.array, np.array]:
+    """Splits prefixes_list rows into typed arrays of prefix, usage and last usage."""
+    prefixes = np.array([x["prefix"] for x in data], dtype=str)
+    usage = np.fromiter((x["usage"] for x in data), dtype=np.int64, count=len(data))
+    last_usage = np.fromiter((x["last_usage"].timestamp() for x in data), dtype=np.float64, count=len(data))
+    return prefixes, usage, last_usage
+
+
 class BotPrefixes(BotData):
-    """Bot data for prefix"""
-    __slots__ = ("predicted_data", )
+    """Bot data for prefix, the scores are cached per guild and bot until the bot's prefixes are written."""
+    __slots__ = ("prefixes", "scores")
 
-    def __init__(self, member: discord.Member, predicted_data: dict):
+    def __init__(self, member: discord.Member, prefixes: np.array, scores: np.array):
         super().__init__(member)
-        self.predicted_data = predicted_data
+        self.prefixes = prefixes
+        self.scores = scores
 
     @classmethod
     async def convert(cls, ctx: StellaContext, argument: str) -> "BotPrefixes":
-        member, data = await super().convert(ctx, argument)
-        return await cls.from_db(ctx, member, data)
+        member = await IsBot().convert(ctx, argument)
+        if (scored := ctx.bot.prefix_scores.get(ctx.guild.id, member.id)) is None:
+            generation = ctx.bot.prefix_scores.generation(ctx.guild.id)
+            query = "SELECT prefix, usage, last_usage FROM prefixes_list WHERE guild_id=$1 AND bot_id=$2"
+            if not (data := await ctx.bot.pool_pg.fetch(query, ctx.guild.id, member.id)):
+                raise NotInDatabase(member)
+            prefixes, usage, last_usage = prefix_arrays(data)
+            scores = await ctx.bot.score_prefixes(usage, last_usage)
+            scored = ctx.bot.prefix_scores.set(ctx.guild.id, member.id, (prefixes, scores), generation=generation)
+        return cls(member, *scored)
 
     @classmethod
-    async def from_db(cls, ctx: StellaContext, member, data):
-        processed = [[x["prefix"], x["usage"], x["last_usage"].timestamp()] for x in data]
-        prediction = await ctx.bot.get_prefixes_dataset(processed)
-        return cls(member, prediction)
+    async def from_guild(cls, ctx: StellaContext) -> List["BotPrefixes"]:
+        """Scores every bot of the guild in a single pass, bots that are no longer in the guild are left out."""
+        guild_id = ctx.guild.id
+        if (guild_bots := ctx.bot.prefix_scores.get_guild(guild_id)) is None:
+            generation = ctx.bot.prefix_scores.generation(guild_id)
+            query = "SELECT bot_id, prefix, usage, last_usage FROM prefixes_list WHERE guild_id=$1 ORDER BY bot_id"
+            data = await ctx.bot.pool_pg.fetch(query, guild_id)
+            scored = {}
+            if data:
+                bot_ids = np.fromiter((x["bot_id"] for x in data), dtype=np.int64, count=len(data))
+                # Rows are sorted by bot_id, so each bot starts where the id changes
+                offsets = np.flatnonzero(np.diff(bot_ids, prepend=-1))
+                prefixes, usage, last_usage = prefix_arrays(data)
+                scores = await ctx.bot.score_prefixes(usage, last_usage, offsets)
+                groups = zip(offsets, np.split(prefixes, offsets[1:]), np.split(scores, offsets[1:]))
+                scored = {int(bot_ids[start]): (p, s) for start, p, s in groups}
+            guild_bots = ctx.bot.prefix_scores.set_guild(guild_id, scored, generation=generation)
+        return [cls(member, *scored) for bot_id, scored in guild_bots.items() if (member := ctx.guild.get_member(bot_id))]
 
     @property
     def prefix(self) -> str:
-        return str(self.predicted_data[self.predicted_data[:, 3].astype(np.float).argmax()][0])
+        return str(self.prefixes[self.scores.argmax()])
 
     @property
-    def aliases(self) -> str:
-        prefixes = self.predicted_data
-        potential = prefixes[prefixes[:, 3].astype(np.float) >= 50]
-        alias = potential[potential[:, 0] != self.prefix]
-        return alias[:, 0].tolist()
+    def aliases(self) -> List[str]:
+        potential = self.scores >= 50
+        potential[self.scores.argmax()] = False
+        return self.prefixes[potential].tolist()
 
     @property
     def all_raw_prefixes(self):
@@ -1,9 +1,15 @@
 from __future__ import annotations
+import asyncio
 import numpy as np
 from typing import Optional
-from tensorflow import keras
-from typing import Dict, Union, List, Tuple
-from utils.decorators import in_executor
+from typing import Any, Callable, Dict, Union, List, Tuple, TypeVar, TYPE_CHECKING
+from utils.executors import get_executor
+
+if TYPE_CHECKING:
+    from tensorflow import keras
+
+T = TypeVar("T")
+K = TypeVar("K")
 
 
 class PrefixNeuralNetwork:
@@ -87,13 +93,107 @@ class PrefixNeuralNetwork:
         result = self.calc_layer(layer1, self.weights2)
         return result
 
+    def score(self, usage: np.array, last_usage: np.array, offsets: Optional[np.array] = None) -> np.array[float]:
+        """Scores each prefix from 0 to 200 in a single pass. usage and last_usage are normalized against the highest
+           value within their group, offsets are the index where each group starts and are sorted. Every row belongs to
+           a single group when offsets is not given."""
+        if offsets is None:
+            offsets = np.zeros(1, dtype=np.intp)
+        sizes = np.diff(offsets, append=len(usage))
+        highest_usage = np.repeat(np.maximum.reduceat(usage, offsets), sizes)
+        highest_last_usage = np.repeat(np.maximum.reduceat(last_usage, offsets), sizes)
+        normalized = np.column_stack((usage / highest_usage, last_usage / highest_last_usage))
+        return self.fit(normalized)[:, 0] * 200
+
+
+class NumpyDerivativeModel:
+    """Same network as the Keras model of DerivativeNeuralNetwork evaluated with plain NumPy, this needs the weights
+       that was exported with DerivativeNeuralNetwork.export_numpy. The normalization is stored as scale and offset."""
+    LAYERS = 3
+
+    def __init__(self, scale: np.array, offset: np.array, layers: List[Tuple[np.array, np.array]]):
+        self.scale = scale
+        self.offset = offset
+        self.layers = layers
+
+    @classmethod
+    def load(cls, path: str) -> NumpyDerivativeModel:
+        with np.load(path) as data:
+            layers = [(data[f"kernel{i}"], data[f"bias{i}"]) for i in range(cls.LAYERS)]
+            return cls(data["scale"], data["offset"], layers)
+
+    @classmethod
+    def from_keras(cls, model: keras.Sequential) -> NumpyDerivativeModel:
+        """Reads the weights of a built Keras model. The normalization is applied on zeros and ones instead of reading
+           the mean and variance, which gives the exact scale and offset Keras uses."""
+        normalization, *dense = model.layers
+        size = model.input_shape[-1]
+        offset = np.asarray(normalization(np.zeros((1, size), dtype=np.float32)))[0]
+        scale = np.asarray(normalization(np.ones((1, size), dtype=np.float32)))[0] - offset
+        return cls(scale, offset, [tuple(layer.get_weights()) for layer in dense])
+
+    def save(self, path: str) -> None:
+        layers = {}
+        for i, (kernel, bias) in enumerate(self.layers):
+            layers.update({f"kernel{i}": kernel, f"bias{i}": bias})
+        np.savez(path, scale=self.scale, offset=self.offset, **layers)
+
+    def predict(self, x: np.array) -> np.array:
+        """Forward pass of Dense(40, relu) -> Dense(40, relu) -> Dense(30, sigmoid) after the normalization."""
+        x = np.asarray(x, dtype=np.float32) * self.scale + self.offset
+        *hidden, (kernel, bias) = self.layers
+        for hidden_kernel, hidden_bias in hidden:
+            x = np.maximum(x @ hidden_kernel + hidden_bias, 0)
+        return 1 / (1 + np.exp(-(x @ kernel + bias)))
+
 
 class DerivativeNeuralNetwork:
-    def __init__(self, path: str):
+    """The model is only built on the first prediction or on warm_up, since importing tensorflow alone takes seconds
+       and most restarts never predict anything. With the numpy engine, path is the exported .npz and tensorflow is
+       never imported."""
+    ENGINES = ("keras", "numpy")
+
+    def __init__(self, path: str, *, engine: Optional[str] = "keras"):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(self.ENGINES)}.")
         self.input_output_size = 30
-        self.model = self.create_neural_network_model(path)
+        self.path = path
+        self.engine = engine
+        self.model = None
+        self.loading: Optional[asyncio.Future] = None
+
+    def load_model(self) -> Union[keras.Sequential, NumpyDerivativeModel]:
+        if self.model is None:
+            if self.engine == "numpy":
+                self.model = NumpyDerivativeModel.load(self.path)
+            else:
+                self.model = self.create_neural_network_model(self.path)
+        return self.model
+
+    def export_numpy(self, destination: str) -> NumpyDerivativeModel:
+        """Dumps the Keras weights into an .npz that the numpy engine can load."""
+        if self.engine != "keras":
+            raise ValueError("Only the keras engine can be exported.")
+        model = NumpyDerivativeModel.from_keras(self.load_model())
+        model.save(destination)
+        return model
+
+    def warm_up(self) -> asyncio.Future:
+        """Loads the model in the ml executor, every caller waits for the same load."""
+        if self.loading is None or (self.loading.done() and self.loading.exception() is not None):
+            self.loading = get_executor("ml").submit(asyncio.get_running_loop(), self.load_model)
+        return self.loading
 
     def create_neural_network_model(self, path: str) -> keras.Sequential:
+        model = self.build_model()
+        model.load_weights(path)
+        return model
+
+    def build_model(self) -> keras.Sequential:
+        """Builds the model with untrained weights. It is built with the input shape right away, otherwise the Dense
+           layers would have no weights until the first call."""
+        from tensorflow import keras
+
         normalization = keras.layers.Normalization(axis=-1)
         SIZE = self.input_output_size
         normalization.adapt(np.zeros(SIZE * 2).reshape((2, SIZE)))
@@ -107,27 +207,58 @@ class DerivativeNeuralNetwork:
         model.compile(optimizer='adam',
                       loss=keras.losses.BinaryCrossentropy(from_logits=True),
                       metrics=['accuracy'])
-
-        model.load_weights(path)
+        model.build((None, SIZE))
         return model
 
-    @in_executor()
-    def predict(self, raw_data: Dict[str, Union[float, int, str]], *,
-                return_raw: Optional[bool] = False) -> Union[str, Tuple[str, List[Tuple[str, float]]]]:
-        data = [(d["letter"], d["position"], d["percentage"]) for d in raw_data]
-        x, original = self.process_input(data)
-        output, = self.model.predict(x)
-        best = output[output >= 0.5]
-        evaluated = "".join(letter for letter, _ in original[:len(best)])
-        if return_raw:
-            evaluated = evaluated, [(letter, prediction) for (letter, _), prediction in zip(original, output)]
-        return evaluated
+    async def run_model(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Calls func once the model is loaded. The numpy engine runs it inline, a forward pass takes microseconds
+           while a thread hop costs more than that."""
+        if self.model is None:
+            await asyncio.shield(self.warm_up())
+        if self.engine == "numpy":
+            return func(*args, **kwargs)
+        return await get_executor("ml").submit(asyncio.get_running_loop(), func, *args, **kwargs)
+
+    async def predict(self, raw_data: List[Dict[str, Union[float, int, str]]], *,
+                      return_raw: Optional[bool] = False) -> Union[str, Tuple[str, List[Tuple[str, float]]]]:
+        return await self.run_model(self.predict_loaded, raw_data, return_raw=return_raw)
 
-    def process_input(self, letters: List[Tuple[str, int, float]]) -> Tuple[np.array, Tuple[str, float]]:
-        input_layout = [("", 0)] * self.input_output_size
-        for prefix, postion, value in letters:
-            input_layout[postion] = (prefix, value)
-        return np.array([[t[1] for t in input_layout]]), input_layout
+    async def predict_many(self, batch: Dict[K, List[Dict[str, Union[float, int, str]]]]
+                           ) -> Dict[K, Tuple[str, List[Tuple[str, float]]]]:
+        """Predicts the prefix of every key in a single forward pass, where each value is the position_letter data
+           of a bot. Each key maps to the prefix and the prediction of each letter."""
+        return await self.run_model(self.predict_many_loaded, batch)
 
+    def predict_loaded(self, raw_data: List[Dict[str, Union[float, int, str]]], *,
+                       return_raw: Optional[bool] = False) -> Union[str, Tuple[str, List[Tuple[str, float]]]]:
+        (evaluated, raw), = self.predict_many_loaded({None: raw_data}).values()
+        return (evaluated, raw) if return_raw else evaluated
 
+    def predict_many_loaded(self, batch: Dict[K, List[Dict[str, Union[float, int, str]]]]
+                            ) -> Dict[K, Tuple[str, List[Tuple[str, float]]]]:
+        if not batch:
+            return {}
+        keys = [*batch]
+        x, layouts = self.process_inputs([[(d["letter"], d["position"], d["percentage"]) for d in batch[key]]
+                                          for key in keys])
+        outputs = self.model.predict(x)
+        return {key: self.evaluate(layout, output) for key, layout, output in zip(keys, layouts, outputs)}
+
+    @staticmethod
+    def evaluate(layout: List[Tuple[str, float]], output: np.array) -> Tuple[str, List[Tuple[str, float]]]:
+        best = output[output >= 0.5]
+        evaluated = "".join(letter for letter, _ in layout[:len(best)])
+        return evaluated, [(letter, float(prediction)) for (letter, _), prediction in zip(layout, output)]
 
+    def process_inputs(self, batch: List[List[Tuple[str, int, float]]]
+                       ) -> Tuple[np.array, List[List[Tuple[str, float]]]]:
+        """Stacks every input into a single (N, input_output_size) array."""
+        x = np.zeros((len(batch), self.input_output_size), dtype=np.float32)
+        layouts = []
+        for row, letters in enumerate(batch):
+            layout = [("", 0)] * self.input_output_size
+            for prefix, position, value in letters:
+                layout[position] = (prefix, value)
+                x[row, position] = value
+            layouts.append(layout)
+        return x, layouts
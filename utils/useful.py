@@ -1,7 +1,6 @@
 import inspect
 import discord
 import datetime
-import ctypes
 import traceback
 import sys
 import asyncio
@@ -11,8 +10,12 @@ import os
 import pytz
 import textwrap
 import operator
-from typing import Callable, Any, Awaitable, Union, Tuple, List, Iterable, Coroutine, Optional, Type, AsyncGenerator, TypeVar, Generator
-from utils.decorators import pages, in_executor
+import collections
+from typing import Callable, Any, Awaitable, Union, Tuple, List, Iterable, Coroutine, Optional, Type, AsyncGenerator, TypeVar, Generator, \
+    Dict, Set, Generic
+from utils.decorators import pages
+from utils.executors import get_executor
+from c_codes.parse_find import Trie as CompiledTrie, RELEASE_GIL_SIZE
 from utils.context_managers import BreakableTyping
 from discord.utils import maybe_coroutine
 from discord.ext import commands
@@ -77,55 +80,161 @@ def default_date(datetime_var: datetime.datetime) -> str:
     return datetime_var.strftime('%d %b %Y %I:%M %p %Z')
 
 
-lib = ctypes.CDLL("./c_codes/parse_find.so")
-multi_find_prefix = lib.multi_find_prefix
-freeing = lib.free_result
-multi_find_prefix.restype = ctypes.c_void_p
-find_commands = lib.find_commands
-find_commands.restype = ctypes.c_void_p
-
-
-class RESULT(ctypes.Structure):
-    _fields_ = [('found_array', ctypes.POINTER(ctypes.c_char_p)),
-                ('size', ctypes.c_int)]
-
-
-def compile_array(string_list: List[str], /) -> Tuple[ctypes.c_char_p, int]:
-    """Converts a list of strings that are sorted into binary that will be accepted by C code."""
-    ArrString = ctypes.c_char_p * len(string_list)
-    binary_array = (x.encode('utf-8') for x in string_list)
-    array_string = ArrString(*binary_array)
-    return array_string, len(string_list)
-
-
-def decode_result(return_result: int, /) -> List[Any]:
-    """Creates a RESULT structure from address given and return a list of the address"""
-    result = RESULT.from_address(return_result)
-    to_return = [x.decode("utf-8") for x in result.found_array[:result.size]]
-    freeing(ctypes.byref(result))
-    return to_return
-
-
-def actually_calls(param: tuple, callback: Callable, /) -> List[Any]:
-    """Handles C functions and return value."""
-    array_stuff, content_buffer = param
-    if array_stuff:
-        array_string, size = array_stuff
-        callback.argtypes = [ctypes.c_char_p * size, ctypes.c_char_p, ctypes.c_int]
-        return_result = callback(array_string, content_buffer, size)
-        return decode_result(return_result)
-
-
-@in_executor()
-def search_prefixes(*args: Any) -> List[Any]:
-    """Pass multi_find_prefix function from C."""
-    return actually_calls(args, multi_find_prefix)
-
-
-@in_executor()
-def search_commands(*args: Any) -> List[Any]:
-    """Pass find_commands function from C."""
-    return actually_calls(args, find_commands)
+class PrefixGate:
+    """Holds the first character of every known prefix for each scope, usually a guild. A message that doesn't start
+       with any of them is rejected in O(1) before any regex or trie search. The characters are lowered so it works
+       for case insensitive prefixes too. A scope that was never added lets every message through."""
+    __slots__ = ("scopes",)
+
+    def __init__(self):
+        self.scopes: Dict[int, Set[str]] = {}
+
+    def add(self, scope: int, prefix: str) -> None:
+        if prefix:
+            self.scopes.setdefault(scope, set()).add(prefix[0].lower())
+
+    def reset(self, scope: int, prefixes: Iterable[str]) -> None:
+        """Replaces the characters of a scope, this is the only way for a removed prefix to stop passing."""
+        self.scopes[scope] = {prefix[0].lower() for prefix in prefixes if prefix}
+
+    def might_match(self, scope: int, content: str) -> bool:
+        if (first_chars := self.scopes.get(scope)) is None:
+            return True
+        return content[:1].lower() in first_chars
+
+    def __contains__(self, scope: int) -> bool:
+        return scope in self.scopes
+
+
+class PrefixCache:
+    """Bounded LRU of the custom prefix for each guild or user. A snowflake without a custom prefix is stored as a
+       negative entry, so it is only looked up once. After load was given the whole internal_prefix table, a snowflake
+       that isn't in the cache is known to use the default prefix without a lookup, for as long as no custom prefix
+       was evicted."""
+    __slots__ = ("maxsize", "default", "entries", "complete")
+
+    def __init__(self, *, maxsize: Optional[int] = 10000, default: Optional[str] = "uwu "):
+        self.maxsize = maxsize
+        self.default = default
+        self.entries: collections.OrderedDict[int, Optional[str]] = collections.OrderedDict()
+        self.complete = False
+
+    def get(self, snowflake_id: int) -> Optional[str]:
+        """Returns the prefix, or None when it is unknown and must be fetched."""
+        try:
+            prefix = self.entries[snowflake_id]
+        except KeyError:
+            return self.default if self.complete else None
+        self.entries.move_to_end(snowflake_id)
+        return self.default if prefix is None else prefix
+
+    def set(self, snowflake_id: int, prefix: Optional[str]) -> str:
+        """Stores the prefix, None is stored as a negative entry. Returns the prefix that is in effect."""
+        self.entries[snowflake_id] = prefix or None
+        self.entries.move_to_end(snowflake_id)
+        while len(self.entries) > self.maxsize:
+            _, evicted = self.entries.popitem(last=False)
+            self.complete &= evicted is None
+        return prefix or self.default
+
+    def load(self, records: Iterable[Tuple[int, str]]) -> None:
+        """Bulk loads the rows of internal_prefix, the cache becomes complete when every row fits."""
+        records = [*records]
+        for snowflake_id, prefix in records:
+            self.set(snowflake_id, prefix)
+        # Older entries are evicted first, so every row is still cached when they all fit
+        self.complete = len(records) <= self.maxsize
+
+    def __contains__(self, snowflake_id: int) -> bool:
+        return snowflake_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class PrefixScoreCache(Generic[T]):
+    """Bounded LRU of the scored prefixes of each bot, grouped by guild. A guild that was scored as a whole is complete,
+       so listing every bot in it doesn't need the database until one of it's bot gets invalidated. Each invalidate
+       bumps the generation of the guild, scores that were fetched before that are not stored."""
+    __slots__ = ("maxsize", "guilds", "complete", "generations")
+
+    def __init__(self, *, maxsize: Optional[int] = 1000):
+        self.maxsize = maxsize
+        self.guilds: collections.OrderedDict[int, Dict[int, T]] = collections.OrderedDict()
+        self.complete: Set[int] = set()
+        self.generations: Dict[int, int] = {}
+
+    def get_guild_bots(self, guild_id: int) -> Dict[int, T]:
+        if (guild_bots := self.guilds.get(guild_id)) is None:
+            guild_bots = self.guilds[guild_id] = {}
+            while len(self.guilds) > self.maxsize:
+                evicted, _ = self.guilds.popitem(last=False)
+                self.complete.discard(evicted)
+        self.guilds.move_to_end(guild_id)
+        return guild_bots
+
+    def get(self, guild_id: int, bot_id: int) -> Optional[T]:
+        if (guild_bots := self.guilds.get(guild_id)) is None:
+            return
+        self.guilds.move_to_end(guild_id)
+        return guild_bots.get(bot_id)
+
+    def get_guild(self, guild_id: int) -> Optional[Dict[int, T]]:
+        """Returns every bot of the guild, or None when the guild was never scored as a whole."""
+        if guild_id in self.complete:
+            return self.get_guild_bots(guild_id)
+
+    def generation(self, guild_id: int) -> int:
+        """Taken before fetching, then handed to set or set_guild."""
+        return self.generations.get(guild_id, 0)
+
+    def set(self, guild_id: int, bot_id: int, value: T, *, generation: Optional[int] = None) -> T:
+        """Stores the value unless the guild was invalidated after generation, the value is returned either way."""
+        if generation is None or generation == self.generation(guild_id):
+            self.get_guild_bots(guild_id)[bot_id] = value
+        return value
+
+    def set_guild(self, guild_id: int, values: Dict[int, T], *, generation: Optional[int] = None) -> Dict[int, T]:
+        """Replaces every bot of the guild, the guild becomes complete. Nothing is stored when the guild was
+           invalidated after generation."""
+        if generation is not None and generation != self.generation(guild_id):
+            return values
+        guild_bots = self.get_guild_bots(guild_id)
+        guild_bots.clear()
+        guild_bots.update(values)
+        self.complete.add(guild_id)
+        return guild_bots
+
+    def invalidate(self, guild_id: int, bot_id: int) -> None:
+        """Forgets the scores of a bot after it's prefixes were written."""
+        if (guild_bots := self.guilds.get(guild_id)) is not None:
+            guild_bots.pop(bot_id, None)
+        self.complete.discard(guild_id)
+        self.generations[guild_id] = self.generation(guild_id) + 1
+
+    def __len__(self) -> int:
+        return len(self.guilds)
+
+
+async def search_trie(trie: Optional[CompiledTrie], method: str, content: str, /) -> Optional[Tuple[str, ...]]:
+    """Short content is searched right away on the loop, which is cheaper than a thread hop. Content from
+       RELEASE_GIL_SIZE onward is searched in the match executor, as the C code releases the GIL for it."""
+    if not trie:
+        return
+    search = getattr(trie, method)
+    if len(content) < RELEASE_GIL_SIZE:
+        return search(content)
+    return await get_executor("match").submit(asyncio.get_running_loop(), search, content)
+
+
+def search_prefixes(trie: Optional[CompiledTrie], content: str, /) -> Coroutine[Any, Any, Optional[Tuple[str, ...]]]:
+    """Walks the content through the prefix trie, returning the interned prefixes the content starts with."""
+    return search_trie(trie, "find_prefix", content)
+
+
+def search_commands(trie: Optional[CompiledTrie], content: str, /) -> Coroutine[Any, Any, Optional[Tuple[str, ...]]]:
+    """Walks each word backward through the reversed command trie, returning the interned commands found."""
+    return search_trie(trie, "find_commands", content)
 
 
 def print_exception(text: str, error: Exception, *, _print: bool = True) -> str:
@@ -253,8 +362,17 @@ class ListCall(list):
     def append(self, rhs: Awaitable) -> list:
         return super().append(rhs)
 
-    def call(self, *args: Any, **kwargs: Any) -> Coroutine:
-        return asyncio.gather(*(maybe_coroutine(func, *args, **kwargs) for func in self))
+    async def call(self, *args: Any, **kwargs: Any) -> List[Any]:
+        """Every coroutine function is started before the sync functions are called, so their I/O is already in
+           flight while a sync function blocks the loop. The results are in the same order as the array."""
+        futures = [asyncio.ensure_future(func(*args, **kwargs)) if inspect.iscoroutinefunction(func) else None
+                   for func in self]
+        # Allows every coroutine to send their first request before blocking the loop
+        await asyncio.sleep(0)
+        for i, func in enumerate(self):
+            if futures[i] is None:
+                futures[i] = asyncio.ensure_future(maybe_coroutine(func, *args, **kwargs))
+        return await asyncio.gather(*futures)
 
 
 def in_local(func: Callable, target: Any) -> Any: